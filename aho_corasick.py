@@ -0,0 +1,56 @@
+"""Поиск многих подстрок за один проход по тексту (алгоритм Ахо — Корасик).
+
+Автомат строится один раз по набору образцов; find проходит текст по
+одному символу и возвращает номера всех образцов, встретившихся в нём
+как подстроки, независимо от их числа.
+"""
+from collections import deque
+
+
+class AhoCorasick:
+    """Автомат по набору образцов; find(text) — множество номеров найденных образцов"""
+
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [frozenset()]
+        for index, pattern in enumerate(self.patterns):
+            if not pattern:
+                raise ValueError("Пустой образец для поиска")
+            node = 0
+            for char in pattern:
+                child = self._goto[node].get(char)
+                if child is None:
+                    child = len(self._goto)
+                    self._goto[node][char] = child
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append(frozenset())
+                node = child
+            self._output[node] = self._output[node] | {index}
+
+        # Ссылки неудач обходом в ширину: у узлов первого уровня они ведут в корень
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                self._output[child] = self._output[child] | self._output[self._fail[child]]
+
+    def find(self, text):
+        """Номера образцов, которые встречаются в text"""
+        goto, fail, output = self._goto, self._fail, self._output
+        found = set()
+        node = 0
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if output[node]:
+                found |= output[node]
+        return found
@@ -4,40 +4,27 @@ import os
 import logging
 from datetime import datetime
 import uuid
-import pandas as pd
-from PIL import Image
 import base64
-from mod import predict_for_multiple_problems  # Основная функция
-from pdf import generate_pdf_report
-import sys
-
-# Настройка логирования с кодировкой UTF-8
-os.makedirs("logs", exist_ok=True)
-LOG_FILE = os.path.join("logs", "app.log")
-
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
-logger.handlers = []
-
-# Обработчик для файла с кодировкой UTF-8
-file_handler = logging.FileHandler(LOG_FILE, mode='a', encoding='utf-8')
-file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-logger.addHandler(file_handler)
-
-# Обработчик для консоли с кодировкой UTF-8
-console_handler = logging.StreamHandler()
-console_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-if sys.stdout.encoding != 'utf-8':
-    try:
-        console_handler.stream = open(sys.stdout.fileno(), mode='w', encoding='utf-8', buffering=1)
-    except Exception as e:
-        logging.error(f"Failed to set console encoding to UTF-8: {str(e)}")
-logger.addHandler(console_handler)
+import hashlib
+from mod import get_model_version
+from profiles import (
+    SKIN_TYPES, AGE_RANGES, GENDERS, EFFECTS, SYMPTOMS, SYMPTOM_DESCRIPTIONS,
+    CONTRAINDICATIONS, ALLERGIES, symptoms_to_problems, compute_recommendations, format_template_text
+)
+from registry import get_registry
+from pdf_jobs import get_pdf_job_queue, QueueFull
+from events import get_event_writer
+from warmup import start_background_warmup
+from static_assets import prepare_image_variants, background_css_url
+from logging_setup import setup_logging
+
+# Логи пишутся через очередь в фоновом потоке, logs/app.log ротируется по размеру
+setup_logging()
 
 # Функция list_to_text
 def list_to_text(x):
     """Преобразует список симптомов или Series в строку, разделённую пробелами"""
-    if isinstance(x, pd.Series):
+    if hasattr(x, 'apply'):  # pandas.Series — без импорта pandas при старте
         return x.apply(lambda lst: ' '.join(lst))
     return ' '.join(x)  # Для обычного списка
 
@@ -48,70 +35,39 @@ MODEL_DIR = "models"  # Папка models в корне репозитория
 TEMPLATES_PATH = os.path.join(MODEL_DIR, "valid_templates.json")
 REGRESSOR_PATH = os.path.join(MODEL_DIR, "best_regressor_tuned_pipeline.pkl")
 
-SKIN_TYPES = ['Нормальная', 'Сухая', 'Жирная', 'Не уверен(а)']
-AGE_RANGES = ['18-25', '25-35', '35-45', '45+']
-GENDERS = ['Мужской', 'Женский']
-EFFECTS = ["Увлажнение", "Лифтинг", "Устранение морщин", "Очищение пор", "Выравнивание тона",
-          "Устранение жирности кожи лица", "Противовоспалительный", "Антивозрастной", "Осветление", "Восстановление кожи лица"]
-SYMPTOMS = {
-    'Черные точки': ['Закупоренные поры', 'Темные точки на поверхности кожи', 'Неровная текстура кожи', 'Шероховатость при прикосновении', 'Серый цвет лица из-за окисления кожного сала'],
-    'Морщины': ['Мелкие линии и складки на коже', 'Потеря упругости',
-                'Дряблость кожи', '"Гусиные лапки" вокруг глаз', 'Носогубные складки',
-                'Неравномерный рельеф кожи', 'Потеря четкости овала лица'],
-    'Обезвоженность': ['Чувство стянутости', 'Шелушение',
-                       'Тусклый цвет лица', 'Мелкие морщинки',
-                       'Повышенная чувствительность', 'Раздражение', 'Зуд', 'Неравномерный тон',
-                       'При надавливании кожа медленно возвращается в исходное положение'],
-    'Жирный блеск': ["Излишняя работа сальных желез",
-                     'Блестящая кожа, особенно в Т-зоне',
-                     'Расширенные поры', 'Склонность к образованию акне',
-                     'Жирность появляется через 2-3 часа после умывания',
-                     'Макияж быстро "плывет"']
-}
-SYMPTOM_DESCRIPTIONS = {
-    'Закупоренные поры': 'Поры забиты кожным салом или омертвевшими клетками, что может привести к появлению черных точек или акне.',
-    'Темные точки на поверхности кожи': 'Маленькие темные пятна, обычно на носу, щеках или подбородке, вызванные окислением кожного сала в порах.',
-    'Неровная текстура кожи': 'Кожа выглядит грубой или неровной на ощупь, часто из-за сухости или закупоренных пор.',
-    'Шероховатость при прикосновении': 'Кожа ощущается шершавой или грубой при касании, часто из-за сухости или ороговения.',
-    'Мелкие линии и складки': 'Тонкие морщины, которые появляются на коже, часто из-за старения или сухости.',
-    'Потеря упругости': 'Кожа становится менее эластичной, может казаться дряблой или обвисшей.',
-    '"Гусиные лапки" вокруг глаз': 'Мелкие морщинки, расходящиеся от внешних уголков глаз, напоминающие следы лапок.',
-    'Носогубные складки': 'Глубокие линии, идущие от крыльев носа к уголкам рта, часто усиливаются с возрастом.',
-    'Чувство стянутости': 'Ощущение, что кожа "натянута" или сухая, особенно после умывания.',
-    'Шелушение': 'Кожа отслаивается мелкими чешуйками, часто из-за сухости или обезвоживания.',
-    'Тусклый цвет лица': 'Кожа выглядит бледной, сероватой или лишенной сияния.',
-    'Повышенная чувствительность': 'Кожа реагирует покраснением, жжением или раздражением на косметику, погоду и т.д.',
-    'Излишняя работа сальных желез': 'Кожа становится жирной из-за чрезмерного выделения кожного сала.',
-    'Блестящая кожа в Т-зоне': 'Лоб, нос и подбородок выглядят жирными и блестящими, особенно к середине дня.',
-    'Расширенные поры': 'Поры выглядят крупными и заметными, часто на носу, щеках или подбородке.',
-    'Склонность к акне': 'Частое появление прыщей, воспалений или угрей на коже.'
-}
-CONTRAINDICATIONS = [
-    "Злокачественные новообразования",
-    "Острые инфекционные заболевания",
-    "Дерматиты или экзема",
-    "Нет"
-]
-ALLERGIES = [
-    "Аллергия на салициловую кислоту",
-    "Аллергия на ретинол",
-    "Аллергия на витамин С",
-    "Аллергия на пептиды",
-    "Аллергия на гиалуроновую кислоту",
-    "Нет"
-]
 BACKGROUND_IMAGE_PATH = os.path.join("assets", "beauty.jpg")
 SUCCESS_PROB_THRESHOLD = 0.1  # Порог эффективности (10%)
 CARE_PRODUCT_TYPES = ["Крем", "Сыворотка", "Гель", "Тоник", "Маска", "Патчи", "Мыло"]
+PDF_ARCHIVE = os.environ.get("BEAUTY_PDF_ARCHIVE", "0") == "1"  # Сохранять копии отчётов в reports/
 
 # ==================== СТИЛИ ====================
+@st.cache_resource
+def load_background_assets():
+    """Один раз на процесс готовит сжатые варианты фонового изображения"""
+    try:
+        paths = prepare_image_variants(BACKGROUND_IMAGE_PATH)
+        with open(paths['thumbnail.webp'], 'rb') as f:
+            thumbnail = f.read()
+        return {
+            'css_url': background_css_url(paths, st.get_option("server.enableStaticServing")),
+            'thumbnail': thumbnail
+        }
+    except Exception as e:
+        logging.error(f"Ошибка подготовки изображения {BACKGROUND_IMAGE_PATH}: {str(e)}")
+        return None
+
 def set_custom_style():
+    assets = load_background_assets()
+    if assets:
+        background_url = assets['css_url']
+    else:
+        background_url = f"data:image/jpg;base64,{image_to_base64(BACKGROUND_IMAGE_PATH)}"
     st.markdown(
         f"""
         <style>
         .stApp {{
             background: linear-gradient(rgba(255, 245, 245, 0.9), rgba(255, 245, 245, 0.95)), 
-                       url('data:image/jpg;base64,{image_to_base64(BACKGROUND_IMAGE_PATH)}');
+                       url('{background_url}');
             background-size: cover;
             background-position: center;
             background-attachment: fixed;
@@ -242,7 +198,7 @@ def image_to_base64(image_path):
 
 # ==================== ФУНКЦИИ ЛОГИРОВАНИЯ ====================
 def log_user_choice(user_data, selected_recommendation):
-    """Сохраняет выбор пользователя в файл"""
+    """Записывает выбор пользователя в журнал событий"""
     try:
         log_entry = {
             'session_id': st.session_state.session_id,
@@ -250,16 +206,14 @@ def log_user_choice(user_data, selected_recommendation):
             'selected_recommendation': selected_recommendation,
             'timestamp': datetime.now().strftime('%Y%m%d_%H%M%S')
         }
-        os.makedirs("user_choices", exist_ok=True)
-        with open(f"user_choices/choice_{st.session_state.session_id}_{log_entry['timestamp']}.json", 'w', encoding='utf-8') as f:
-            json.dump(log_entry, f, ensure_ascii=False, indent=2)
+        get_event_writer().append('choice', st.session_state.session_id, log_entry, log_entry['timestamp'])
         logging.info(f"Выбор пользователя сохранён: {selected_recommendation['method']}_{selected_recommendation['type']}")
     except Exception as e:
         logging.error(f"Ошибка сохранения выбора: {str(e)}")
         st.error(f"Ошибка сохранения выбора: {str(e)}")
 
 def log_user_feedback(selected_recommendation, rating, feedback):
-    """Сохраняет отзыв пользователя в файл"""
+    """Записывает отзыв пользователя в журнал событий"""
     try:
         feedback_entry = {
             'session_id': st.session_state.session_id,
@@ -268,32 +222,18 @@ def log_user_feedback(selected_recommendation, rating, feedback):
             'feedback': feedback,
             'timestamp': datetime.now().strftime('%Y%m%d_%H%M%S')
         }
-        os.makedirs("user_feedback", exist_ok=True)
-        with open(f"user_feedback/feedback_{st.session_state.session_id}_{feedback_entry['timestamp']}.json", 'w', encoding='utf-8') as f:
-            json.dump(feedback_entry, f, ensure_ascii=False, indent=2)
+        get_event_writer().append('feedback', st.session_state.session_id, feedback_entry, feedback_entry['timestamp'])
         logging.info(f"Отзыв пользователя сохранён: рейтинг {rating}")
     except Exception as e:
         logging.error(f"Ошибка сохранения отзыва: {str(e)}")
         st.error(f"Ошибка сохранения отзыва: {str(e)}")
 
 # ==================== ФУНКЦИИ ====================
-def symptoms_to_problems(symptoms):
-    symptom_to_problem = {}
-    for problem, symptom_list in SYMPTOMS.items():
-        unified_problem = problem.replace("ё", "е")
-        for symptom in symptom_list:
-            symptom_to_problem[symptom] = unified_problem
-    problems = list(set(symptom_to_problem.get(s, "") for s in symptoms if s in symptom_to_problem))
-    logging.info(f"Симптомы {symptoms} преобразованы в проблемы: {problems}")
-    return problems
-
 def save_to_json(data):
+    """Записывает анкету в журнал событий (запись на диск — в фоновом потоке)"""
     try:
-        os.makedirs("user_data", exist_ok=True)
-        filename = f"user_data/{st.session_state.session_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-        logging.info(f"Данные сохранены в {filename}")
+        get_event_writer().append('user_data', st.session_state.session_id, data)
+        logging.info(f"Анкета сессии {st.session_state.session_id} поставлена в журнал событий")
         return True
     except Exception as e:
         logging.error(f"Ошибка сохранения данных: {str(e)}")
@@ -308,31 +248,22 @@ def extract_expected_effects(template):
     return []
 
 def check_compatibility(template, user_allergies, is_pregnant):
+    catalog = get_registry().get().catalog
     active_ingredients = template.get("active_ingredients", [])
+    # Быстрая проверка по битовой маске каталога; имя ингредиента ищем, только если совпадение есть
+    if not catalog.template_allergy_hit(template, user_allergies):
+        user_allergies = []
     for allergy in user_allergies:
         allergen = allergy.replace("Аллергия на ", "").lower()
         for ingredient in active_ingredients:
             if ingredient.lower() == allergen:
-                logging.info(f"Рекомендация отклонена: содержит {ingredient}, на который у пользователя аллергия")
+                logging.debug("Рекомендация отклонена: содержит %s, на который у пользователя аллергия", ingredient)
                 return False, f"Рекомендация содержит {ingredient}, на который у вас аллергия."
     if is_pregnant and template.get("contraindicated_during_pregnancy", False):
-        logging.info("Рекомендация отклонена: противопоказана при беременности")
+        logging.debug("Рекомендация отклонена: противопоказана при беременности")
         return False, "Рекомендация противопоказана при беременности."
     return True, None
 
-def format_template_text(template):
-    lines = template.split('\n')
-    formatted_lines = []
-    for line in lines:
-        line = line.strip()
-        if line:
-            if ': ' in line:
-                key, value = line.split(': ', 1)
-                formatted_lines.append(f"**{key}:** {value}")
-            else:
-                formatted_lines.append(f"{line}")
-    return '\n\n'.join(formatted_lines)  # Двойной перенос для разделения блоков
-
 # ==================== ИНТЕРФЕЙС ====================
 def init_session():
     if 'session_id' not in st.session_state:
@@ -343,7 +274,7 @@ def init_session():
             'last_save': None,
             'confirmed_recommendation': None
         })
-    logging.info(f"Инициализирована сессия с ID: {st.session_state.session_id}")
+    logging.debug("Сессия %s", st.session_state.session_id)
 
 def main_questionnaire():
     init_session()
@@ -489,6 +420,63 @@ def main_questionnaire():
             missing = [k for k, v in required_fields.items() if not v]
             st.error(f"Заполните обязательные поля: {', '.join(missing)}")
 
+RECOMMENDATION_INPUT_FIELDS = ['skin_type', 'age_range', 'symptoms', 'allergies', 'contraindications', 'is_pregnant']
+
+def recommendations_cache_key(user_data):
+    """Стабильный ключ входных данных рекомендаций плюс версия модели и каталога"""
+    payload = {field: user_data.get(field) for field in RECOMMENDATION_INPUT_FIELDS}
+    digest = hashlib.sha256(json.dumps(payload, ensure_ascii=False, sort_keys=True).encode('utf-8')).hexdigest()
+    return f"{get_model_version()}:{digest}"
+
+def get_recommendations(user_data):
+    """Рекомендации для анкеты, запомненные в сессии между перезапусками скрипта.
+
+    Выбор в списке, слайдер и ввод отзыва перезапускают скрипт, но не меняют
+    анкету, поэтому модель заново не вызывается. Кэш сбрасывается кнопкой
+    «Новый анализ» (очистка сессии) или сменой версии модели/каталога.
+    """
+    cache_key = recommendations_cache_key(user_data)
+    cached = st.session_state.get('recommendations_cache')
+    if cached is not None and cached['key'] == cache_key:
+        return cached['user_problems'], cached['all_recommendations']
+
+    user_problems, all_recommendations = compute_recommendations(user_data)
+    st.session_state.recommendations_cache = {
+        'key': cache_key,
+        'user_problems': user_problems,
+        'all_recommendations': all_recommendations
+    }
+    return user_problems, all_recommendations
+
+@st.fragment(run_every=1)
+def pdf_job_progress(job_id):
+    """Опрашивает фоновое задание раз в секунду, не перерисовывая всю страницу"""
+    job = get_pdf_job_queue().get(job_id)
+    if job is not None and job.active:
+        st.progress(job.progress, text="Готовим отчёт...")
+    else:
+        st.rerun()
+
+def show_pdf_job():
+    """Прогресс построения PDF, а затем кнопка скачивания"""
+    job_id = st.session_state.get('pdf_job_id')
+    if not job_id:
+        return
+    job = get_pdf_job_queue().get(job_id)
+    if job is None:
+        st.session_state.pdf_job_id = None
+    elif job.active:
+        pdf_job_progress(job_id)
+    elif job.error:
+        st.error(f"Ошибка при создании PDF: {job.error}")
+    else:
+        st.download_button(
+            "Скачать PDF",
+            job.result,
+            file_name=f"skincare_report_{datetime.now().strftime('%Y%m%d')}.pdf",
+            mime="application/pdf"
+        )
+
 def show_recommendations():
     st.markdown("""
     <div style="text-align: center; margin-bottom: 2rem;">
@@ -497,8 +485,8 @@ def show_recommendations():
     </div>
     """, unsafe_allow_html=True)
     
-    # Добавляем отладочный вывод, чтобы проверить состояние сессии
-    logging.info(f"Состояние сессии в show_recommendations: {st.session_state}")
+    # Только ключи сессии и только в режиме отладки: содержимое сессии большое и личное
+    logging.debug("Ключи сессии в show_recommendations: %s", list(st.session_state.keys()))
     if 'responses' not in st.session_state:
         st.error("Данные не найдены! Заполните анкету сначала.")
         logging.error("st.session_state.responses отсутствует!")
@@ -510,8 +498,8 @@ def show_recommendations():
     try:
         col1, col2 = st.columns([1, 2])
         with col1:
-            image = Image.open(BACKGROUND_IMAGE_PATH)
-            st.image(image, use_column_width=True)
+            assets = load_background_assets()
+            st.image(assets['thumbnail'] if assets else BACKGROUND_IMAGE_PATH, use_column_width=True)
         with col2:
             pass
     except Exception as e:
@@ -536,49 +524,7 @@ def show_recommendations():
         if is_pregnant and not shown_warning:
             st.warning("⚠️ Вы беременны. Процедуры с противопоказаниями исключены.")
 
-        user_problems = list(set(symptoms_to_problems(user_symptoms)))
-        logging.info(f"Обнаружены проблемы: {user_problems}")
-
-        all_results = predict_for_multiple_problems(
-            problems=user_problems,
-            skin_type=skin_type,
-            age_range=age_range,
-            symptoms=user_symptoms,
-            user_allergies=user_data['allergies'],
-            user_contraindications=user_data['contraindications'],
-            is_pregnant=user_data['is_pregnant'],
-            top_per_problem=3
-        )
-
-        all_recommendations = []
-        problems_with_errors = []
-
-        for problem_result in all_results:
-            if 'error' in problem_result:
-                error_message = problem_result['error']
-                logging.warning(f"Ошибка для проблемы: {error_message}")
-                problems_with_errors.append(error_message)
-                continue
-            
-            problem = problem_result['problem']
-            recommendations = problem_result.get('recommendations', [])
-            
-            if not recommendations:
-                logging.warning(f"Для проблемы '{problem}' не найдено рекомендаций")
-                continue
-            
-            for rec in recommendations:
-                all_recommendations.append({
-                    'problem': problem,
-                    'symptom': ', '.join([s for s in user_symptoms if symptoms_to_problems([s])[0] == problem]),
-                    'method': rec['method'],
-                    'type': rec['type'],
-                    'success_prob': rec['success_prob'],  # Сохраняем процент для дальнейшего форматирования
-                    'course_duration': rec.get('course_duration', 'Не указана'),
-                    'expected_results': rec.get('expected_effect', 'Не указан'),
-                    'contraindications': ', '.join(rec.get('contraindications', ['Нет'])),
-                    'template': rec.get('template', 'Описание отсутствует')
-                })
+        user_problems, all_recommendations = get_recommendations(user_data)
 
         problems_without_recs = [
             p for p in user_problems 
@@ -682,30 +628,34 @@ def show_recommendations():
     # Кнопки "Сохранить отчёт в PDF" и "Новый анализ"
     if st.button("Сохранить отчёт в PDF", use_container_width=True):
         try:
-            pdf_path = generate_pdf_report(
+            job = get_pdf_job_queue().submit(
+                st.session_state.session_id,
                 st.session_state.responses,
                 st.session_state.recommendations,
-                session_id=st.session_state.session_id
+                archive_session_id=st.session_state.session_id if PDF_ARCHIVE else None
             )
-            with open(pdf_path, "rb") as f:
-                st.download_button(
-                    "Скачать PDF",
-                    f,
-                    file_name=f"skincare_report_{datetime.now().strftime('%Y%m%d')}.pdf"
-                )
-        except Exception as e:
-            st.error(f"Ошибка при создании PDF: {e}")
+            st.session_state.pdf_job_id = job.id
+        except QueueFull:
+            st.warning("Сейчас создаётся много отчётов. Попробуйте через минуту.")
+    show_pdf_job()
 
     if st.button("Новый анализ", use_container_width=True):
         st.session_state.clear()
         st.session_state.page = "questionnaire"
         st.rerun()
 
+@st.cache_resource
+def start_cache_warmup():
+    """Один раз на процесс запускает прогрев кэша рекомендаций по частым анкетам"""
+    return start_background_warmup()
+
 # ==================== ЗАПУСК ====================
 if __name__ == "__main__":
     if not os.path.exists("assets"):
         os.makedirs("assets")
     
+    start_cache_warmup()
+    
     set_custom_style()
     
     if st.session_state.get('page', 'questionnaire') == "questionnaire":
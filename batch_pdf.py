@@ -0,0 +1,256 @@
+"""Пакетная перегенерация PDF-отчётов по сохранённым анкетам.
+
+Анкеты берутся из журнала событий (events.py): записи анкет
+(app.save_to_json) и выборов рекомендаций (app.log_user_choice); для каждой
+сессии используется самая свежая из них.
+Рекомендации пересчитываются пачками одним вызовом модели, отчёты
+верстаются в пуле процессов и пишутся в reports/batch/<session_id>.pdf.
+
+Готовые сессии отмечаются в файле контрольных точек (JSONL в папке
+отчётов), поэтому прерванный запуск можно продолжить той же командой.
+Сессия считается готовой, только если отчёт собран из той же записи
+журнала, той же версией модели/каталога и той же версией отчёта.
+
+    python batch_pdf.py --workers 4
+    python batch_pdf.py --limit 100 --out-dir /tmp/reports
+    python batch_pdf.py --restart          # игнорировать контрольные точки
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from events import STORES, iter_stored_events, open_event_store, read_event
+from logging_setup import LOG_FORMAT, LOG_LEVEL
+
+logger = logging.getLogger(__name__)
+
+OUTPUT_DIR = os.path.join("reports", "batch")
+CHECKPOINT_NAME = "checkpoint.jsonl"
+BATCH_WORKERS = int(os.environ.get("BEAUTY_BATCH_WORKERS", str(os.cpu_count() or 1)))
+BATCH_CHUNK_SIZE = int(os.environ.get("BEAUTY_BATCH_CHUNK_SIZE", "16"))
+
+
+def latest_profile_refs(store=None):
+    """Для каждой сессии — ссылка на самую свежую анкету; при равном времени анкета важнее выбора"""
+    latest = {}
+    for event in iter_stored_events(('user_data', 'choice'), store=store):
+        rank = (event.timestamp, event.kind == 'user_data')
+        if event.session_id not in latest or rank >= latest[event.session_id][0]:
+            latest[event.session_id] = (rank, event.ref)
+    return {session_id: ref for session_id, (_, ref) in sorted(latest.items())}
+
+
+def read_profile(ref):
+    """Анкета из записи анкеты или из записи о выборе рекомендации"""
+    data = read_event(ref)
+    if 'user_data' in data and 'selected_recommendation' in data:
+        return data['user_data']
+    return data
+
+
+# Поля анкеты, без которых нельзя пересчитать рекомендации (profiles.recommendation_request)
+REQUIRED_PROFILE_FIELDS = {
+    'symptoms': list,
+    'skin_type': str,
+    'age_range': str,
+    'allergies': list,
+    'contraindications': list,
+    'is_pregnant': bool
+}
+
+
+def profile_error(user_data):
+    """Описание ошибки сохранённой анкеты или None, если по ней можно пересчитать рекомендации"""
+    if not isinstance(user_data, dict):
+        return f"анкета должна быть объектом, а не {type(user_data).__name__}"
+    for field, field_type in REQUIRED_PROFILE_FIELDS.items():
+        if field not in user_data:
+            return f"в анкете нет поля '{field}'"
+        if not isinstance(user_data[field], field_type):
+            return f"поле '{field}' анкеты имеет тип {type(user_data[field]).__name__}"
+    return None
+
+
+def load_checkpoint(path):
+    """Сессии, отчёты которых уже готовы: {session_id: запись}"""
+    done = {}
+    if not os.path.exists(path):
+        return done
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # недописанная строка после аварийной остановки
+            if record.get('status') == 'done':
+                done[record['session_id']] = record
+            else:
+                done.pop(record.get('session_id'), None)
+    return done
+
+
+def _render_chunk(chunk, out_dir):
+    """Выполняется в процессе пула: пересчитывает рекомендации пачкой и верстает отчёты"""
+    from pdf import count_pdf_pages, render_pdf_report
+    from profiles import compute_recommendations_batch
+
+    records = []
+    profiles = []
+    for session_id, ref in chunk:
+        try:
+            user_data = read_profile(ref)
+        except (OSError, ValueError, KeyError) as e:
+            records.append({'session_id': session_id, 'source': ref, 'status': 'failed', 'error': str(e)})
+            continue
+        # Некорректная анкета пропускается сама, не роняя остальную пачку
+        error = profile_error(user_data)
+        if error is not None:
+            records.append({'session_id': session_id, 'source': ref, 'status': 'failed', 'error': error})
+            continue
+        profiles.append((session_id, ref, user_data))
+
+    try:
+        batch = compute_recommendations_batch([user_data for _, _, user_data in profiles])
+    except Exception as e:
+        logger.warning(f"Ошибка пересчёта пачки из {len(profiles)} анкет, пересчитываем по одной: {str(e)}")
+        batch = []
+        for _, _, user_data in profiles:
+            try:
+                batch.extend(compute_recommendations_batch([user_data]))
+            except Exception as e:
+                batch.append(e)
+
+    for (session_id, ref, user_data), computed in zip(profiles, batch):
+        if isinstance(computed, Exception):
+            records.append({'session_id': session_id, 'source': ref, 'status': 'failed', 'error': str(computed)})
+            continue
+        _, all_recommendations = computed
+        started = time.perf_counter()
+        try:
+            pdf_bytes = render_pdf_report(user_data, {
+                'daily_routine': all_recommendations,
+                'products': [],
+                'procedures': []
+            })
+            target = os.path.join(out_dir, f"{session_id}.pdf")
+            with open(target + ".tmp", 'wb') as f:
+                f.write(pdf_bytes)
+            os.replace(target + ".tmp", target)
+        except Exception as e:
+            records.append({'session_id': session_id, 'source': ref, 'status': 'failed', 'error': str(e)})
+            continue
+        records.append({
+            'session_id': session_id,
+            'source': ref,
+            'status': 'done',
+            'pages': count_pdf_pages(pdf_bytes),
+            'bytes': len(pdf_bytes),
+            'seconds': round(time.perf_counter() - started, 4)
+        })
+    return records
+
+
+def _chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def run_batch(out_dir=OUTPUT_DIR, workers=BATCH_WORKERS, chunk_size=BATCH_CHUNK_SIZE,
+              store=None, limit=None, restart=False, report_every=5.0):
+    """Перегенерирует отчёты всех сессий; возвращает сводку со скоростью в страницах в секунду"""
+    from mod import get_model_version
+    from pdf import REPORT_VERSION
+
+    os.makedirs(out_dir, exist_ok=True)
+    checkpoint_path = os.path.join(out_dir, CHECKPOINT_NAME)
+    if restart and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    version = f"{get_model_version()}-r{REPORT_VERSION}"
+    done = load_checkpoint(checkpoint_path)
+
+    sessions = latest_profile_refs(store)
+    pending = [
+        (session_id, ref) for session_id, ref in sessions.items()
+        if not (session_id in done and done[session_id].get('source') == ref
+                and done[session_id].get('version') == version)
+    ]
+    skipped = len(sessions) - len(pending)
+    if limit is not None:
+        pending = pending[:limit]
+    logger.info(f"Сессий: {len(sessions)}, уже готово: {skipped}, в работе: {len(pending)}")
+
+    stats = {'sessions': len(sessions), 'skipped': skipped, 'rendered': 0, 'failed': 0, 'pages': 0}
+    start = time.monotonic()
+    last_report = start
+    chunks = _chunks(pending, chunk_size)
+    with open(checkpoint_path, 'a', encoding='utf-8') as checkpoint, \
+            ProcessPoolExecutor(max_workers=workers) as executor:
+        # Держим в работе ограниченное число пачек, чтобы не читать все анкеты заранее
+        in_flight = set()
+        while True:
+            while len(in_flight) < workers * 2:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                in_flight.add(executor.submit(_render_chunk, chunk, out_dir))
+            if not in_flight:
+                break
+            finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                for record in future.result():
+                    record['version'] = version
+                    checkpoint.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    if record['status'] == 'done':
+                        stats['rendered'] += 1
+                        stats['pages'] += record['pages']
+                    else:
+                        stats['failed'] += 1
+                        logger.warning(f"Отчёт {record['session_id']} не создан: {record['error']}")
+            checkpoint.flush()
+
+            now = time.monotonic()
+            if now - last_report >= report_every:
+                last_report = now
+                elapsed = now - start
+                logger.info(f"Готово {stats['rendered']}/{len(pending)}, "
+                            f"{stats['pages'] / elapsed:.1f} стр/с")
+
+    elapsed = time.monotonic() - start
+    stats['seconds'] = round(elapsed, 3)
+    stats['pages_per_second'] = round(stats['pages'] / elapsed, 2) if elapsed > 0 else 0.0
+    stats['reports_per_second'] = round(stats['rendered'] / elapsed, 2) if elapsed > 0 else 0.0
+    stats['version'] = version
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пакетная перегенерация PDF-отчётов")
+    parser.add_argument('--out-dir', default=OUTPUT_DIR)
+    parser.add_argument('--workers', type=int, default=BATCH_WORKERS)
+    parser.add_argument('--chunk-size', type=int, default=BATCH_CHUNK_SIZE, help="анкет на один вызов модели")
+    parser.add_argument('--store', choices=sorted(STORES), default=None, help="хранилище событий")
+    parser.add_argument('--store-path', default=None)
+    parser.add_argument('--limit', type=int, default=None, help="не больше N сессий за запуск")
+    parser.add_argument('--restart', action='store_true', help="начать заново, не глядя на контрольные точки")
+    args = parser.parse_args()
+    # Обычный обработчик в консоль, а не очередь: он продолжает работать и в процессах пула
+    logging.basicConfig(level=LOG_LEVEL, format=LOG_FORMAT)
+
+    store = open_event_store(args.store, args.store_path) if args.store else None
+    stats = run_batch(args.out_dir, args.workers, args.chunk_size, store, args.limit, args.restart)
+    print(json.dumps(stats, ensure_ascii=False))
+    return 1 if stats['failed'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
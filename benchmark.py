@@ -0,0 +1,285 @@
+"""Воспроизводимый бенчмарк горячих путей: модель, ранжирование, помощники UI, PDF.
+
+Анкеты генерируются из справочников приложения (profiles.synthetic_profiles)
+с фиксированным seed, число повторов каждого сценария фиксировано. Для
+каждого сценария выводятся перцентили задержки и пик выделенной памяти
+(tracemalloc, отдельным проходом, чтобы не искажать время).
+
+    python benchmark.py                          # все сценарии
+    python benchmark.py --only predict_cold pdf_render
+    python benchmark.py --save-baseline          # записать benchmark_baseline.json
+    python benchmark.py --compare                # сравнить с benchmark_baseline.json
+
+Каждый сценарий прогоняется --rounds раз, в отчёт идёт прогон с наименьшей
+медианой: так меньше влияют фоновые процессы машины. При --compare код
+возврата 1, если p50 какого-то сценария хуже базового больше чем на
+--tolerance (по умолчанию 25%) и больше чем на --min-delta-ms. Базовый файл
+зависит от машины: сравнивать имеет смысл только замеры с одного окружения.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import pdf
+from cache import DiskLRUCache
+from mod import (get_top_recommendations, load_models_and_templates, predict_for_multiple_problems,
+                 recommendation_cache)
+from profiles import compute_recommendations, format_template_text, symptoms_to_problems, synthetic_profiles
+from registry import ModelRegistry, get_registry
+
+BASELINE_PATH = "benchmark_baseline.json"
+SEED = 20240601
+PROFILE_COUNT = 400
+
+
+def _request(profile, problems=None):
+    return {
+        # Порядок проблем из symptoms_to_problems зависит от хэширования строк в процессе
+        'problems': problems if problems is not None else sorted(symptoms_to_problems(profile['symptoms'])),
+        'skin_type': profile['skin_type'],
+        'age_range': profile['age_range'],
+        'symptoms': profile['symptoms'],
+        'user_allergies': profile['allergies'],
+        'user_contraindications': profile['contraindications'],
+        'is_pregnant': profile['is_pregnant']
+    }
+
+
+class Scenario:
+    """Сценарий бенчмарка: setup готовит входы, run(i) — одна замеряемая операция"""
+
+    def __init__(self, name, description, iterations, run, setup=None, per_iteration=None, teardown=None):
+        self.name = name
+        self.description = description
+        self.iterations = iterations
+        self.run = run
+        self.setup = setup
+        self.per_iteration = per_iteration  # незамеряемая подготовка перед каждым повтором
+        self.teardown = teardown  # вызывается после всех прогонов сценария, в том числе при ошибке
+
+
+def clear_prediction_caches():
+    """Сбрасывает кэш рекомендаций и кэш эмбеддингов симптомов NumPy-модели"""
+    recommendation_cache.clear()
+    embedding_cache = getattr(get_registry().get().regressor, '_embedding_cache', None)
+    if embedding_cache is not None:
+        embedding_cache.clear()
+
+
+def build_scenarios(profiles):
+    """Сценарии по горячим путям mod.py, profiles.py и pdf.py"""
+    requests = [_request(profile) for profile in profiles]
+    requests = [request for request in requests if request['problems']]
+    # Аргументы get_top_recommendations: первая проблема анкеты и остальные поля запроса
+    single = [(request['problems'][0], {k: v for k, v in request.items() if k != 'problems'})
+              for request in requests]
+    symptom_lists = [profile['symptoms'] for profile in profiles]
+    templates = load_models_and_templates()[1]
+    template_texts = [templates[i].get('template', '') for i in range(0, len(templates), max(1, len(templates) // 200))]
+    pdf_inputs = []
+    for profile in profiles[:20]:
+        _, recommendations = compute_recommendations(profile)
+        pdf_inputs.append((profile, {'daily_routine': recommendations, 'products': [], 'procedures': []}))
+    pdf_cache_state = {}
+
+    def cached_generate(i):
+        profile, recommendations = pdf_inputs[i % len(pdf_inputs)]
+        pdf.generate_pdf_report(profile, recommendations)
+
+    def use_temp_pdf_cache():
+        # Кэш отчётов бенчмарка живёт во временной папке, чтобы не трогать reports/cache
+        if not pdf_cache_state:
+            pdf_cache_state['disk_cache'] = pdf.pdf_disk_cache
+            pdf_cache_state['directory'] = tempfile.mkdtemp(prefix="beauty_bench_")
+            pdf.pdf_disk_cache = DiskLRUCache(pdf_cache_state['directory'], pdf.PDF_CACHE_BYTES, suffix=".pdf")
+        pdf.pdf_memory_cache.clear()
+        for profile, recommendations in pdf_inputs:
+            pdf.generate_pdf_report(profile, recommendations)
+
+    def restore_pdf_cache():
+        if pdf_cache_state:
+            pdf.pdf_disk_cache = pdf_cache_state.pop('disk_cache')
+            shutil.rmtree(pdf_cache_state.pop('directory'), ignore_errors=True)
+            pdf.pdf_memory_cache.clear()
+
+    return [
+        Scenario('load_models_cold', "load_models_and_templates: загрузка нового реестра с диска", 5,
+                 lambda i: ModelRegistry().get()),
+        Scenario('load_models_warm', "load_models_and_templates: общий реестр уже загружен", 2000,
+                 lambda i: load_models_and_templates()),
+        Scenario('top_recommendations_cold', "get_top_recommendations, промах кэша", 300,
+                 lambda i: get_top_recommendations(single[i % len(single)][0], **single[i % len(single)][1]),
+                 per_iteration=lambda i: clear_prediction_caches()),
+        Scenario('predict_cold', "predict_for_multiple_problems, промах кэша", 300,
+                 lambda i: predict_for_multiple_problems(**requests[i % len(requests)]),
+                 per_iteration=lambda i: clear_prediction_caches()),
+        Scenario('predict_cached', "predict_for_multiple_problems, попадание в кэш", 2000,
+                 lambda i: predict_for_multiple_problems(**requests[i % 50]),
+                 setup=lambda: [predict_for_multiple_problems(**request) for request in requests[:50]]),
+        Scenario('symptoms_to_problems', "symptoms_to_problems", 5000,
+                 lambda i: symptoms_to_problems(symptom_lists[i % len(symptom_lists)])),
+        Scenario('format_template_text', "format_template_text по текстам каталога", 5000,
+                 lambda i: format_template_text(template_texts[i % len(template_texts)])),
+        Scenario('pdf_render', "generate_pdf_report без кэша (вёрстка reportlab)", 40,
+                 lambda i: pdf.render_pdf_report(*pdf_inputs[i % len(pdf_inputs)])),
+        Scenario('pdf_cached', "generate_pdf_report, отчёт уже в кэше", 2000,
+                 cached_generate, setup=use_temp_pdf_cache, teardown=restore_pdf_cache),
+    ]
+
+
+def _time_scenario(scenario):
+    if scenario.setup:
+        scenario.setup()
+    # Прогрев: ленивые импорты и первые обращения не должны попадать в замер
+    for i in range(min(3, scenario.iterations)):
+        if scenario.per_iteration:
+            scenario.per_iteration(i)
+        scenario.run(i)
+    durations = np.empty(scenario.iterations)
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for i in range(scenario.iterations):
+            if scenario.per_iteration:
+                scenario.per_iteration(i)
+            started = time.perf_counter_ns()
+            scenario.run(i)
+            durations[i] = time.perf_counter_ns() - started
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    return durations / 1e6
+
+
+def _peak_memory(scenario, iterations):
+    peak = 0
+    tracemalloc.start()
+    try:
+        for i in range(iterations):
+            if scenario.per_iteration:
+                scenario.per_iteration(i)
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            scenario.run(i)
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - before)
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+def run_benchmarks(only=None, scale=1.0, rounds=3):
+    """Запускает сценарии; возвращает словарь результатов для вывода и сравнения"""
+    profiles = synthetic_profiles(PROFILE_COUNT, SEED)
+    get_registry().get()
+    results = {}
+    for scenario in build_scenarios(profiles):
+        if only and scenario.name not in only:
+            continue
+        scenario.iterations = max(1, int(scenario.iterations * scale))
+        try:
+            durations = min((_time_scenario(scenario) for _ in range(rounds)), key=np.median)
+            peak_alloc = _peak_memory(scenario, min(3, scenario.iterations))
+        finally:
+            if scenario.teardown:
+                scenario.teardown()
+        results[scenario.name] = {
+            'description': scenario.description,
+            'iterations': scenario.iterations,
+            'rounds': rounds,
+            'mean_ms': round(float(durations.mean()), 4),
+            'p50_ms': round(float(np.percentile(durations, 50)), 4),
+            'p95_ms': round(float(np.percentile(durations, 95)), 4),
+            'p99_ms': round(float(np.percentile(durations, 99)), 4),
+            'max_ms': round(float(durations.max()), 4),
+            'peak_alloc_kb': round(peak_alloc / 1024, 1)
+        }
+    return {
+        'environment': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'model_version': get_registry().version
+        },
+        # ru_maxrss в Linux — в килобайтах
+        'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'results': results
+    }
+
+
+def compare(current, baseline, tolerance, min_delta_ms=0.0):
+    """Строки сравнения по p50 и список сценариев, ставших медленнее допуска"""
+    lines = []
+    regressions = []
+    for name, result in current['results'].items():
+        base = baseline['results'].get(name)
+        if base is None:
+            lines.append(f"  {name:<26} нет в базовом файле")
+            continue
+        ratio = result['p50_ms'] / base['p50_ms'] if base['p50_ms'] else float('inf')
+        mark = ""
+        if ratio > 1 + tolerance and result['p50_ms'] - base['p50_ms'] > min_delta_ms:
+            regressions.append(name)
+            mark = "  <-- медленнее"
+        lines.append(f"  {name:<26} p50 {base['p50_ms']:9.3f} -> {result['p50_ms']:9.3f} мс  x{ratio:5.2f}{mark}")
+    if baseline.get('environment', {}).get('platform') != current['environment']['platform']:
+        lines.append("  внимание: базовый файл снят на другой платформе")
+    return lines, regressions
+
+
+def print_report(report):
+    print(f"{'сценарий':<26} {'n':>6} {'p50 мс':>10} {'p95 мс':>10} {'p99 мс':>10} {'пик КБ':>10}")
+    for name, result in report['results'].items():
+        print(f"{name:<26} {result['iterations']:>6} {result['p50_ms']:>10.3f} {result['p95_ms']:>10.3f} "
+              f"{result['p99_ms']:>10.3f} {result['peak_alloc_kb']:>10.1f}")
+    print(f"max RSS: {report['max_rss_mb']} МБ, модель {report['environment']['model_version']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк рекомендаций, помощников UI и PDF")
+    parser.add_argument('--only', nargs='*', default=None, help="имена сценариев")
+    parser.add_argument('--scale', type=float, default=1.0, help="множитель числа повторов")
+    parser.add_argument('--rounds', type=int, default=3, help="прогонов каждого сценария")
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--compare', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.25, help="допустимое замедление p50 (доля)")
+    parser.add_argument('--min-delta-ms', type=float, default=0.01, help="меньшие изменения p50 не считаются")
+    parser.add_argument('--json', action='store_true', help="вывести результат в JSON")
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.only, args.scale, args.rounds)
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Базовый файл сохранён: {args.baseline}")
+
+    if args.compare:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        lines, regressions = compare(report, baseline, args.tolerance, args.min_delta_ms)
+        print(f"Сравнение с {args.baseline}:")
+        print("\n".join(lines))
+        if regressions:
+            print(f"Медленнее допуска ({args.tolerance:.0%}): {', '.join(regressions)}", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,147 @@
+import os
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Потокобезопасный LRU-кэш фиксированного размера со счётчиками попаданий"""
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        return {'size': len(self._data), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses}
+
+
+class DiskLRUCache:
+    """Кэш файлов в одной папке с общим бюджетом по размеру.
+
+    Имя файла — ключ, время изменения — время последнего обращения, поэтому
+    порядок вытеснения переживает перезапуск процесса. Индекс размеров
+    строится при первом обращении; файлы, удалённые другим процессом,
+    просто считаются промахом.
+    """
+
+    def __init__(self, directory, max_bytes, suffix=""):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self._index = None  # ключ -> размер, от давно не читанных к свежим
+        self._total = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, key):
+        return os.path.join(self.directory, key + self.suffix)
+
+    def _load_index(self):
+        if self._index is not None:
+            return
+        entries = []
+        if os.path.isdir(self.directory):
+            for entry in os.scandir(self.directory):
+                if entry.is_file() and entry.name.endswith(self.suffix) and not entry.name.endswith(".tmp"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, entry.name[:len(entry.name) - len(self.suffix)], stat.st_size))
+        entries.sort()
+        self._index = OrderedDict((key, size) for _, key, size in entries)
+        self._total = sum(self._index.values())
+
+    def get_path(self, key):
+        """Путь к файлу ключа (и отметка об обращении) или None"""
+        path = self.path(key)
+        with self._lock:
+            self._load_index()
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                self._total -= self._index.pop(key, 0)
+                self.misses += 1
+                return None
+            if key in self._index:
+                self._index.move_to_end(key)
+            else:
+                # Файл записан другим процессом
+                self._index[key] = os.path.getsize(path)
+                self._total += self._index[key]
+            self.hits += 1
+            return path
+
+    def get(self, key):
+        """Содержимое файла ключа или None"""
+        path = self.get_path(key)
+        if path is None:
+            return None
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, data):
+        """Записывает данные атомарно, вытесняет старые файлы сверх бюджета; возвращает путь"""
+        path = self.path(key)
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._load_index()
+            self._total += len(data) - self._index.pop(key, 0)
+            self._index[key] = len(data)
+            while self._total > self.max_bytes and len(self._index) > 1:
+                old_key, size = self._index.popitem(last=False)
+                self._total -= size
+                try:
+                    os.remove(self.path(old_key))
+                except FileNotFoundError:
+                    pass
+        return path
+
+    def __len__(self):
+        with self._lock:
+            self._load_index()
+            return len(self._index)
+
+    def stats(self):
+        with self._lock:
+            self._load_index()
+            return {'files': len(self._index), 'bytes': self._total, 'max_bytes': self.max_bytes,
+                    'hits': self.hits, 'misses': self.misses}
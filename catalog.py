@@ -0,0 +1,513 @@
+"""Каталог шаблонов рекомендаций и его скомпилированная форма.
+
+Сборка (compile_catalog, `python catalog.py build`) проверяет шаблоны
+valid_templates.json, отклоняя некорректные с понятными ошибками
+(CatalogError), заранее считает нормализованные поля и пишет артефакт
+с контрольной суммой и версией. Во время работы каталог доверяет
+артефакту: проверок и нормализации шаблонов на каждый запрос нет.
+
+    python catalog.py check   # только проверить шаблоны
+    python catalog.py build   # собрать models/valid_templates.catalog.{json,bin}
+"""
+import hashlib
+import json
+import mmap
+import os
+import sys
+import threading
+
+import numpy as np
+
+from aho_corasick import AhoCorasick
+
+ALLERGY_PREFIX = "Аллергия на "
+
+# Поля с длинным текстом: в скомпилированном каталоге они лежат в отдельном
+# файле, отображаемом в память, и читаются только для показа рекомендаций
+TEXT_FIELDS = ('template', 'contraindications', 'usage_instruction')
+# Производные текстовые поля, которые считаются один раз при компиляции
+DERIVED_TEXT_FIELDS = ('contraindications_lower',)
+CATALOG_FORMAT_VERSION = 3
+TEMPLATES_PATH = os.path.join("models", "valid_templates.json")
+
+# Поля, без которых шаблон нельзя отобрать и оценить моделью
+REQUIRED_FIELDS = ('problem', 'skin_type', 'age_range', 'method', 'type')
+STRING_FIELDS = ('symptom', 'name') + TEXT_FIELDS
+STRING_LIST_FIELDS = ('active_ingredients', 'effects')
+
+# Словарь для вычисления method_complexity (по умолчанию 1, если метода в нём нет)
+method_complexity_map = {
+    "Уходовая косметика": 1,
+    "Пилинги": 2,
+    "Массаж": 2,
+    "Тейпирование": 2,
+    "Аппаратная косметология": 3,
+    "Инъекционная косметология": 5
+}
+
+# Противопоказания анкеты (profiles.CONTRAINDICATIONS) и их синонимы в текстах
+# шаблонов. Шаблон считается противопоказанным, если в его тексте есть само
+# название или любой синоним; сравнение без учёта регистра. Маски по одним
+# названиям дают ровно тот же штраф, что прежняя проверка подстрокой.
+# Синоним меняет штрафы за противопоказания (например, «дерматит» ловит
+# шаблоны, где «Дерматиты или экзема» не встречается целиком), поэтому
+# добавлять его нужно вместе с пересобранным эталоном parity_check.py --save.
+CONTRAINDICATION_SYNONYMS = {
+    "Злокачественные новообразования": (),
+    "Острые инфекционные заболевания": (),
+    "Дерматиты или экзема": ()
+}
+
+_MISSING = object()
+
+
+def normalize_problem(problem):
+    """Приводит название проблемы к виду для сравнения: ё -> е, нижний регистр"""
+    return problem.replace("ё", "е").lower()
+
+
+def allergy_to_ingredient(allergy):
+    """'Аллергия на ретинол' -> 'ретинол' (в нижнем регистре, для сравнения с ингредиентами)"""
+    return allergy.replace(ALLERGY_PREFIX, "").lower()
+
+
+class CatalogError(ValueError):
+    """Шаблоны не прошли проверку при сборке каталога; errors — список описаний"""
+
+    def __init__(self, errors):
+        self.errors = errors
+        shown = "\n".join(f"  {error}" for error in errors[:50])
+        more = f"\n  ... и ещё {len(errors) - 50}" if len(errors) > 50 else ""
+        super().__init__(f"Некорректные шаблоны каталога (ошибок: {len(errors)}):\n{shown}{more}")
+
+
+def template_errors(template):
+    """Описания ошибок одного шаблона; пустой список — шаблон корректен"""
+    if not isinstance(template, dict):
+        return [f"шаблон должен быть объектом, а не {type(template).__name__}"]
+    errors = []
+    for field in REQUIRED_FIELDS:
+        value = template.get(field)
+        if value is None:
+            errors.append(f"нет обязательного поля '{field}'")
+        elif not isinstance(value, str) or not value.strip():
+            errors.append(f"поле '{field}' должно быть непустой строкой")
+    for field in STRING_FIELDS:
+        if field in template and not isinstance(template[field], str):
+            errors.append(f"поле '{field}' должно быть строкой")
+    for field in STRING_LIST_FIELDS:
+        value = template.get(field, [])
+        if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+            errors.append(f"поле '{field}' должно быть списком строк")
+    if not isinstance(template.get('contraindicated_during_pregnancy', False), bool):
+        errors.append("поле 'contraindicated_during_pregnancy' должно быть true или false")
+    if not isinstance(template.get('course_duration', ''), (str, int, float)):
+        errors.append("поле 'course_duration' должно быть строкой или числом")
+    return errors
+
+
+def validate_templates(templates):
+    """Проверяет все шаблоны и выбрасывает CatalogError со списком всех ошибок"""
+    if not isinstance(templates, list):
+        raise CatalogError(["каталог должен быть списком шаблонов"])
+    errors = []
+    for number, template in enumerate(templates):
+        label = f"шаблон #{number}"
+        if isinstance(template, dict) and isinstance(template.get('problem'), str):
+            label += f" ({template['problem']} / {template.get('method')} / {template.get('type')})"
+        errors.extend(f"{label}: {error}" for error in template_errors(template))
+    if errors:
+        raise CatalogError(errors)
+
+
+def normalize_text(text):
+    """Текст для поиска терминов: нижний регистр, как в проверке подстрокой"""
+    return text.lower()
+
+
+def contraindication_vocabulary(synonyms=CONTRAINDICATION_SYNONYMS):
+    """{термин: нормализованные образцы для поиска}; номер термина — номер его бита в масках"""
+    if len(synonyms) > 64:
+        raise ValueError("Словарь противопоказаний не помещается в 64-битную маску")
+    return {
+        term: sorted({normalize_text(term), *(normalize_text(synonym) for synonym in term_synonyms)})
+        for term, term_synonyms in synonyms.items()
+    }
+
+
+def contraindication_matcher(vocabulary):
+    """Автомат по всем образцам словаря и номер бита для каждого образца"""
+    patterns = []
+    pattern_bits = []
+    for bit, term_patterns in enumerate(vocabulary.values()):
+        patterns.extend(term_patterns)
+        pattern_bits.extend([bit] * len(term_patterns))
+    return AhoCorasick(patterns), pattern_bits
+
+
+def derived_fields(templates):
+    """Нормализованные поля шаблонов, которые иначе считались бы на каждый запрос.
+
+    contraindication_masks — для каждого шаблона биты терминов
+    contraindication_terms, найденных в его тексте противопоказаний.
+    """
+    vocabulary = contraindication_vocabulary()
+    matcher, pattern_bits = contraindication_matcher(vocabulary)
+    masks = []
+    for template in templates:
+        found = matcher.find(normalize_text(template.get('contraindications', '')))
+        masks.append(sum(1 << bit for bit in {pattern_bits[i] for i in found}))
+    return {
+        'problem_keys': [normalize_problem(template['problem']) for template in templates],
+        'method_complexity': [method_complexity_map.get(template['method'], 1) for template in templates],
+        'contraindication_terms': vocabulary,
+        'contraindication_masks': masks
+    }
+
+
+def _derived_texts(template):
+    return {'contraindications_lower': template.get('contraindications', '').lower()}
+
+
+def split_template(template):
+    """Делит шаблон на метаданные и длинные тексты"""
+    meta = {key: value for key, value in template.items() if key not in TEXT_FIELDS}
+    texts = {key: template[key] for key in TEXT_FIELDS if key in template}
+    texts.update(_derived_texts(template))
+    return meta, texts
+
+
+class InMemoryTexts:
+    """Тексты шаблонов в виде обычных строк Python (если скомпилированного каталога нет)"""
+
+    def __init__(self, texts):
+        self._texts = texts
+
+    def get(self, template_id, field, default=None):
+        return self._texts[template_id].get(field, default)
+
+
+class MappedTexts:
+    """Тексты шаблонов в одном UTF-8 файле, отображённом в память.
+
+    Таблица смещений хранит для каждого шаблона и поля пару (начало, конец);
+    -1 означает, что поля в шаблоне не было. Страницы файла общие для всех
+    процессов, читающих один и тот же каталог.
+    """
+
+    def __init__(self, blob_path, offsets, fields):
+        self._fields = {field: i for i, field in enumerate(fields)}
+        self._offsets = np.asarray(offsets, dtype=np.int64).reshape(-1, len(fields), 2)
+        with open(blob_path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            self._blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+
+    def get(self, template_id, field, default=None):
+        start, end = self._offsets[template_id, self._fields[field]]
+        if start < 0:
+            return default
+        return self._blob[start:end].decode('utf-8')
+
+
+def compiled_catalog_paths(templates_path):
+    """Пути к файлам скомпилированного каталога рядом с исходным JSON"""
+    base = os.path.splitext(templates_path)[0]
+    return base + ".catalog.json", base + ".catalog.bin"
+
+
+def _catalog_checksum(body, blob):
+    """sha256 байтов метаданных каталога и файла текстов"""
+    digest = hashlib.sha256(body)
+    digest.update(blob)
+    return digest.hexdigest()
+
+
+def compile_catalog(templates, meta_path, blob_path, source_sha256=""):
+    """Проверяет шаблоны и записывает каталог в два файла: метаданные (JSON) и тексты.
+
+    Первая строка файла метаданных — заголовок с версией формата, исходным
+    JSON и контрольной суммой остальной части файла вместе с файлом текстов.
+    Некорректные шаблоны отклоняются целиком (CatalogError), артефакт при
+    этом не пишется. Возвращает версию каталога.
+    """
+    validate_templates(templates)
+    fields = TEXT_FIELDS + DERIVED_TEXT_FIELDS
+    meta = []
+    offsets = []
+    chunks = []
+    position = 0
+    for template in templates:
+        template_meta, texts = split_template(template)
+        meta.append(template_meta)
+        for field in fields:
+            if field not in texts:
+                offsets.append([-1, -1])
+                continue
+            data = texts[field].encode('utf-8')
+            chunks.append(data)
+            offsets.append([position, position + len(data)])
+            position += len(data)
+
+    blob = b''.join(chunks)
+    body = json.dumps({
+        'text_fields': list(fields),
+        'offsets': offsets,
+        'templates': meta,
+        'derived': derived_fields(templates)
+    }, ensure_ascii=False).encode('utf-8')
+    checksum = _catalog_checksum(body, blob)
+    header = {
+        'format_version': CATALOG_FORMAT_VERSION,
+        'source_sha256': source_sha256,
+        'checksum': checksum,
+        'catalog_version': f"{CATALOG_FORMAT_VERSION}-{checksum[:12]}"
+    }
+
+    # Пишем во временные файлы и переименовываем, чтобы читатели не увидели половину каталога.
+    # Имена уникальны для процесса и потока: каталог могут собирать несколько воркеров сразу
+    suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+    blob_tmp, meta_tmp = blob_path + suffix, meta_path + suffix
+    try:
+        with open(blob_tmp, 'wb') as f:
+            f.write(blob)
+        with open(meta_tmp, 'wb') as f:
+            f.write(json.dumps(header).encode('utf-8') + b"\n" + body)
+        os.replace(blob_tmp, blob_path)
+        os.replace(meta_tmp, meta_path)
+    finally:
+        for tmp_path in (blob_tmp, meta_tmp):
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    return header['catalog_version']
+
+
+def load_compiled_catalog(meta_path, blob_path, source_sha256=None):
+    """Открывает скомпилированный каталог; None, если его нет или он собран из другого JSON.
+
+    Контрольная сумма сверяется один раз при открытии; повреждённый артефакт
+    тоже даёт None, и его пересобирают из исходного JSON.
+    """
+    if not (os.path.exists(meta_path) and os.path.exists(blob_path)):
+        return None
+    with open(meta_path, 'rb') as f:
+        header = json.loads(f.readline())
+        if header.get('format_version') != CATALOG_FORMAT_VERSION:
+            return None
+        if source_sha256 is not None and header.get('source_sha256') != source_sha256:
+            return None
+        body = f.read()
+    with open(blob_path, 'rb') as f:
+        if _catalog_checksum(body, f.read()) != header.get('checksum'):
+            return None
+    compiled = json.loads(body)
+    # Словарь противопоказаний в коде поменялся — маски шаблонов надо пересчитать
+    if compiled['derived']['contraindication_terms'] != contraindication_vocabulary():
+        return None
+    texts = MappedTexts(blob_path, compiled['offsets'], compiled['text_fields'])
+    return Catalog(compiled['templates'], texts, compiled['derived'], header['catalog_version'])
+
+
+class TemplateSequence:
+    """Список полных шаблонов, собираемых из каталога по запросу"""
+
+    def __init__(self, catalog):
+        self._catalog = catalog
+
+    def __len__(self):
+        return len(self._catalog)
+
+    def __getitem__(self, template_id):
+        if isinstance(template_id, slice):
+            return [self._catalog.template(i) for i in range(len(self))[template_id]]
+        return self._catalog.template(template_id)
+
+    def __iter__(self):
+        return (self._catalog.template(i) for i in range(len(self)))
+
+
+class Catalog:
+    """Каталог шаблонов с индексом по (проблема, тип кожи, возрастной диапазон).
+
+    Нормализация названий проблем выполняется один раз при построении индекса,
+    поэтому поиск кандидатов для запроса сводится к одному обращению к словарю.
+    Активные ингредиенты каждого шаблона хранятся битовой маской над словарём
+    аллергенов каталога, беременность — массивом флагов.
+
+    Короткие поля шаблонов (meta) держатся в памяти, длинные тексты читаются
+    из хранилища texts по номеру шаблона, только когда они действительно нужны.
+
+    Шаблоны каталога уже проверены (validate_templates), а нормализованные
+    поля (derived) посчитаны при сборке; здесь они только читаются.
+    """
+
+    def __init__(self, meta, texts, derived, version=None):
+        self.meta = meta
+        self.texts = texts
+        self.version = version
+        self.templates = TemplateSequence(self)
+        self.method_complexity = np.asarray(derived['method_complexity'], dtype=np.float64)
+        # Бит термина словаря по его названию из анкеты и маски шаблонов. Синонимы
+        # расширяют только поиск по текстам шаблонов: свободный ввод вроде «опухол»
+        # в contraindication_hits ищется подстрокой, как раньше
+        self.contraindication_bits = {
+            normalize_text(term): bit for bit, term in enumerate(derived['contraindication_terms'])
+        }
+        self.contraindication_masks = np.array(derived['contraindication_masks'], dtype=np.uint64)
+        index = {}
+        for template_id, (template, problem_key) in enumerate(zip(meta, derived['problem_keys'])):
+            # Номер шаблона переходит в его копии (template()) и в результаты mod._build_result
+            template['template_id'] = template_id
+            key = (problem_key, template['skin_type'], template['age_range'])
+            index.setdefault(key, []).append(template_id)
+        self._ids = {key: tuple(ids) for key, ids in index.items()}
+
+        # Словарь аллергенов: все ингредиенты каталога в нижнем регистре
+        ingredients = sorted({ing.lower() for t in meta for ing in t.get('active_ingredients', [])})
+        self.allergen_bits = {ingredient: bit for bit, ingredient in enumerate(ingredients)}
+        self._mask_words = max(1, (len(ingredients) + 63) // 64)
+        self.allergen_masks = np.array(
+            [self.ingredient_mask(t.get('active_ingredients', [])) for t in meta],
+            dtype=np.uint64
+        ).reshape(len(meta), self._mask_words)
+        self.pregnancy_flags = np.array(
+            [bool(t.get('contraindicated_during_pregnancy', False)) for t in meta], dtype=bool
+        )
+
+        # Коды методов для ранжирования без обращения к словарям шаблонов
+        methods = sorted({str(t.get('method')) for t in meta})
+        method_codes = {method: code for code, method in enumerate(methods)}
+        self.method_codes = np.array([method_codes[str(t.get('method'))] for t in meta], dtype=np.int32)
+
+    @classmethod
+    def from_templates(cls, templates):
+        """Каталог из списка шаблонов в памяти (без скомпилированных файлов); проверяет шаблоны"""
+        validate_templates(templates)
+        parts = [split_template(template) for template in templates]
+        meta = [meta for meta, _ in parts]
+        return cls(meta, InMemoryTexts([texts for _, texts in parts]), derived_fields(templates))
+
+    def __len__(self):
+        return len(self.meta)
+
+    def text(self, template_id, field, default=None):
+        """Длинное текстовое поле шаблона"""
+        return self.texts.get(template_id, field, default)
+
+    def template(self, template_id):
+        """Полный шаблон: метаданные и тексты"""
+        template = dict(self.meta[template_id])
+        for field in TEXT_FIELDS:
+            value = self.texts.get(template_id, field, _MISSING)
+            if value is not _MISSING:
+                template[field] = value
+        return template
+
+    @staticmethod
+    def _key(problem, skin_type, age_range):
+        return normalize_problem(problem), skin_type, age_range
+
+    def candidate_ids(self, problem, skin_type, age_range):
+        """Номера шаблонов, точно совпадающих по проблеме, типу кожи и возрасту"""
+        return self._ids.get(self._key(problem, skin_type, age_range), ())
+
+    def candidates(self, problem, skin_type, age_range):
+        """Шаблоны, точно совпадающие по проблеме, типу кожи и возрасту"""
+        return tuple(self.template(i) for i in self.candidate_ids(problem, skin_type, age_range))
+
+    def template_id(self, template):
+        """Номер шаблона по полю template_id, если он из этого каталога, иначе None.
+
+        Номер сверяется с методом и типом шаблона: словарь мог прийти из
+        прежней версии каталога (например, из состояния сессии до перезагрузки).
+        """
+        template_id = template.get('template_id')
+        if not isinstance(template_id, int) or not 0 <= template_id < len(self.meta):
+            return None
+        meta = self.meta[template_id]
+        if meta.get('method') != template.get('method') or meta.get('type') != template.get('type'):
+            return None
+        return template_id
+
+    def _mask(self, names):
+        words = [0] * self._mask_words
+        for name in names:
+            bit = self.allergen_bits.get(name)
+            if bit is not None:
+                words[bit // 64] |= 1 << (bit % 64)
+        return words
+
+    def ingredient_mask(self, ingredients):
+        """Битовая маска списка активных ингредиентов"""
+        return self._mask(ing.lower() for ing in ingredients)
+
+    def allergy_mask(self, user_allergies):
+        """Битовая маска аллергий пользователя; аллергены вне словаря каталога ни с чем не совпадают"""
+        return np.array(self._mask(allergy_to_ingredient(a) for a in user_allergies or ()), dtype=np.uint64)
+
+    def allergy_hits(self, template_ids, user_allergies):
+        """Для каждого шаблона: есть ли в нём ингредиент, на который у пользователя аллергия"""
+        mask = self.allergy_mask(user_allergies)
+        return (self.allergen_masks[np.asarray(template_ids, dtype=np.intp)] & mask).any(axis=1)
+
+    def contraindication_hits(self, template_ids, user_contraindications):
+        """Для каждого шаблона: упомянуто ли в нём какое-либо из противопоказаний пользователя.
+
+        Названия терминов словаря (варианты анкеты) проверяются по битовым маскам,
+        посчитанным при сборке; прочие строки, в том числе синонимы, введённые
+        в API, ищутся подстрокой, как раньше.
+        """
+        template_ids = np.asarray(template_ids, dtype=np.intp)
+        mask = 0
+        unknown = []
+        for contraindication in user_contraindications or ():
+            bit = self.contraindication_bits.get(normalize_text(contraindication))
+            if bit is None:
+                unknown.append(contraindication.lower())
+            else:
+                mask |= 1 << bit
+        hits = (self.contraindication_masks[template_ids] & np.uint64(mask)) != 0
+        if unknown:
+            hits |= np.array([
+                any(term in self.text(i, 'contraindications_lower') for term in unknown)
+                for i in template_ids.tolist()
+            ], dtype=bool)
+        return hits
+
+    def template_allergy_hit(self, template, user_allergies):
+        """То же для одного шаблона, в том числе не из каталога"""
+        template_id = self.template_id(template)
+        if template_id is None:
+            # Ингредиенты чужого шаблона могут не входить в словарь каталога
+            ingredients = {ing.lower() for ing in template.get('active_ingredients', [])}
+            return any(allergy_to_ingredient(a) in ingredients for a in user_allergies or ())
+        return bool((self.allergen_masks[template_id] & self.allergy_mask(user_allergies)).any())
+
+
+def main(argv):
+    command = argv[1] if len(argv) > 1 else 'build'
+    templates_path = argv[2] if len(argv) > 2 else TEMPLATES_PATH
+    with open(templates_path, 'rb') as f:
+        data = f.read()
+    try:
+        templates = json.loads(data.decode('utf-8'))
+        if command == 'check':
+            validate_templates(templates)
+            print(f"Шаблонов: {len(templates)}, ошибок нет")
+            return 0
+        if command == 'build':
+            meta_path, blob_path = compiled_catalog_paths(templates_path)
+            version = compile_catalog(templates, meta_path, blob_path, hashlib.sha256(data).hexdigest())
+            print(f"Собран каталог {version}: {meta_path}, {blob_path} ({len(templates)} шаблонов)")
+            return 0
+    except CatalogError as e:
+        print(str(e), file=sys.stderr)
+        return 1
+    except ValueError as e:
+        print(f"{templates_path} не является корректным JSON: {str(e)}", file=sys.stderr)
+        return 1
+    print(f"Неизвестная команда: {command}")
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,473 @@
+"""Журнал событий: анкеты, выборы рекомендаций и отзывы.
+
+Раньше каждое событие записывалось отдельным JSON-файлом прямо в потоке
+запроса. Теперь события ставятся в очередь, а фоновый поток записывает их
+пачками (group commit) в одно из хранилищ:
+
+    jsonl   — сегменты events/events-<время>-<pid>.jsonl, новый сегмент по
+              размеру (BEAUTY_EVENT_SEGMENT_MB) или возрасту (BEAUTY_EVENT_SEGMENT_SECONDS);
+    sqlite  — база events/events.db в режиме WAL;
+    files   — прежняя раскладка: файл на событие в user_data/, user_choices/
+              и user_feedback/ (для совместимости).
+
+Хранилище выбирается переменной BEAUTY_EVENT_STORE (по умолчанию jsonl),
+путь — BEAUTY_EVENT_PATH. Читатели (прогрев кэша, пакетные отчёты) видят
+события выбранного хранилища и, если оно не files, ещё и старые файлы.
+
+Пачку, которую не удалось записать, писатель повторяет с растущей паузой
+(BEAUTY_EVENT_RETRIES, BEAUTY_EVENT_RETRY_BACKOFF), а после последней
+неудачи откладывает в BEAUTY_EVENT_SPILL_PATH (строки jsonl), откуда её
+можно перенести в журнал вручную.
+
+Каждое событие при чтении получает ссылку ref — строку, по которой его
+можно прочитать снова через read_event (например, в другом процессе).
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+EVENT_STORE = os.environ.get("BEAUTY_EVENT_STORE", "jsonl")
+EVENT_PATH = os.environ.get("BEAUTY_EVENT_PATH")
+EVENTS_DIR = "events"
+EVENT_SEGMENT_BYTES = int(float(os.environ.get("BEAUTY_EVENT_SEGMENT_MB", "64")) * 1024 * 1024)
+EVENT_SEGMENT_SECONDS = float(os.environ.get("BEAUTY_EVENT_SEGMENT_SECONDS", "3600"))
+EVENT_BATCH_SIZE = int(os.environ.get("BEAUTY_EVENT_BATCH_SIZE", "256"))
+EVENT_FLUSH_MS = float(os.environ.get("BEAUTY_EVENT_FLUSH_MS", "100"))  # сколько ждать попутчиков для пачки
+EVENT_QUEUE_SIZE = int(os.environ.get("BEAUTY_EVENT_QUEUE_SIZE", "10000"))
+EVENT_FSYNC = os.environ.get("BEAUTY_EVENT_FSYNC", "1") == "1"  # fsync после каждой пачки
+EVENT_RETRIES = int(os.environ.get("BEAUTY_EVENT_RETRIES", "5"))  # повторы записи пачки после ошибки
+EVENT_RETRY_BACKOFF = float(os.environ.get("BEAUTY_EVENT_RETRY_BACKOFF", "0.1"))  # первая пауза, с; дальше ×2
+# Куда откладываются пачки, которые так и не удалось записать (строки в формате jsonl)
+EVENT_SPILL_PATH = os.environ.get("BEAUTY_EVENT_SPILL_PATH", os.path.join(EVENTS_DIR, "failed_events.jsonl"))
+
+TIMESTAMP_FORMAT = '%Y%m%d_%H%M%S'
+
+# Виды событий и их место в прежней раскладке: (папка, префикс имени файла)
+LEGACY_LAYOUT = {
+    'user_data': ("user_data", ""),
+    'choice': ("user_choices", "choice_"),
+    'feedback': ("user_feedback", "feedback_"),
+}
+
+# Событие в очереди на запись; data — уже сериализованный JSON
+PendingEvent = namedtuple('PendingEvent', 'kind session_id timestamp data')
+# Прочитанное событие
+StoredEvent = namedtuple('StoredEvent', 'kind session_id timestamp data ref')
+
+
+def jsonl_line(event):
+    """Строка журнала jsonl для события из очереди"""
+    return (f'{{"kind": {json.dumps(event.kind)}, "session_id": {json.dumps(event.session_id)}, '
+            f'"timestamp": {json.dumps(event.timestamp)}, "data": {event.data}}}\n').encode('utf-8')
+
+
+def parse_legacy_name(name, prefix=""):
+    """'<prefix><session_id>_<YYYYmmdd>_<HHMMSS>.json' -> (session_id, 'YYYYmmdd_HHMMSS')"""
+    if not (name.startswith(prefix) and name.endswith('.json')):
+        return None
+    parts = name[len(prefix):-len('.json')].rsplit('_', 2)
+    if len(parts) != 3:
+        return None
+    session_id, date, clock = parts
+    return session_id, f"{date}_{clock}"
+
+
+class FileEventStore:
+    """Прежняя раскладка: отдельный JSON-файл с отступами на каждое событие"""
+
+    name = 'files'
+
+    def __init__(self, root="."):
+        self.root = root
+
+    def serialize(self, data):
+        return json.dumps(data, ensure_ascii=False, indent=2)
+
+    def _path(self, kind, session_id, timestamp):
+        directory, prefix = LEGACY_LAYOUT[kind]
+        return os.path.join(self.root, directory, f"{prefix}{session_id}_{timestamp}.json")
+
+    def write_batch(self, events):
+        for event in events:
+            path = self._path(event.kind, event.session_id, event.timestamp)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(event.data)
+
+    def close(self):
+        pass
+
+    def iter_events(self, kinds=None, newest_first=False):
+        entries = []
+        for kind, (directory, prefix) in LEGACY_LAYOUT.items():
+            directory = os.path.join(self.root, directory)
+            if (kinds is not None and kind not in kinds) or not os.path.isdir(directory):
+                continue
+            for entry in os.scandir(directory):
+                parsed = parse_legacy_name(entry.name, prefix)
+                if parsed is not None and entry.is_file():
+                    entries.append((parsed[1], kind, parsed[0], entry.path))
+        entries.sort(reverse=newest_first)
+        for timestamp, kind, session_id, path in entries:
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Не удалось прочитать {path}: {str(e)}")
+                continue
+            yield StoredEvent(kind, session_id, timestamp, data, f"file:{path}")
+
+
+class JsonlEventStore:
+    """Сегменты JSONL: одна строка на событие, новый файл по размеру или времени"""
+
+    name = 'jsonl'
+
+    def __init__(self, directory=EVENTS_DIR, max_bytes=EVENT_SEGMENT_BYTES,
+                 max_age=EVENT_SEGMENT_SECONDS, fsync=EVENT_FSYNC):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.fsync = fsync
+        self._file = None
+        self._size = 0
+        self._opened_at = 0.0
+
+    def serialize(self, data):
+        return json.dumps(data, ensure_ascii=False)
+
+    def _open_segment(self):
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = datetime.now().strftime(TIMESTAMP_FORMAT)
+        for attempt in range(1000):
+            suffix = f"-{attempt}" if attempt else ""
+            path = os.path.join(self.directory, f"events-{stamp}-{os.getpid()}{suffix}.jsonl")
+            if not os.path.exists(path):
+                break
+        self._file = open(path, 'ab')
+        self._size = 0
+        self._opened_at = time.monotonic()
+
+    def write_batch(self, events):
+        if self._file is not None and (self._size >= self.max_bytes
+                                       or time.monotonic() - self._opened_at >= self.max_age):
+            self.close()
+        if self._file is None:
+            self._open_segment()
+        data = b"".join(jsonl_line(event) for event in events)
+        start = self._file.tell()
+        try:
+            self._file.write(data)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+        except Exception:
+            self._discard_partial(start)
+            raise
+        self._size += len(data)
+
+    def _discard_partial(self, start):
+        """После ошибки записи обрезает сегмент до начала пачки и закрывает его.
+
+        Иначе следующая пачка дописалась бы к недописанной строке и испортила
+        обе записи. Если обрезать не удалось, хвост остаётся последней строкой
+        сегмента (читатели её пропускают), а запись продолжится в новом сегменте.
+        """
+        file, self._file = self._file, None
+        truncated = False
+        try:
+            file.truncate(start)
+            truncated = True
+        except Exception as e:
+            logger.warning(f"Не удалось обрезать сегмент {file.name} после ошибки записи: {str(e)}")
+        try:
+            file.close()
+            if truncated and start == 0:
+                os.remove(file.name)  # пустой сегмент не нужен
+        except Exception:
+            pass
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def segments(self):
+        if not os.path.isdir(self.directory):
+            return []
+        names = [name for name in os.listdir(self.directory)
+                 if name.startswith("events-") and name.endswith(".jsonl")]
+        return [os.path.join(self.directory, name) for name in sorted(names, key=_segment_order)]
+
+    def iter_events(self, kinds=None, newest_first=False):
+        segments = self.segments()
+        for path in (reversed(segments) if newest_first else segments):
+            events = []
+            offset = 0
+            with open(path, 'rb') as f:
+                for line in f:
+                    line_offset = offset
+                    offset += len(line)
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # строка, которую писатель ещё не дописал
+                    if kinds is None or record['kind'] in kinds:
+                        events.append(StoredEvent(record['kind'], record['session_id'], record['timestamp'],
+                                                  record['data'], f"jsonl:{path}:{line_offset}"))
+            yield from (reversed(events) if newest_first else events)
+
+
+def _segment_order(name):
+    """events-<время>-<pid>[-<n>].jsonl -> (время, pid, n): сегмент -1 идёт после основного"""
+    parts = name[len("events-"):-len(".jsonl")].split('-')
+    try:
+        return parts[0], int(parts[1]), int(parts[2]) if len(parts) > 2 else 0
+    except (IndexError, ValueError):
+        return parts[0], 0, 0
+
+
+class SqliteEventStore:
+    """Локальная база SQLite в режиме WAL; пачка событий — одна транзакция"""
+
+    name = 'sqlite'
+
+    def __init__(self, path=os.path.join(EVENTS_DIR, "events.db")):
+        self.path = path
+        self._connection = None
+
+    def serialize(self, data):
+        return json.dumps(data, ensure_ascii=False)
+
+    def _connect(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Пишет в базу только поток писателя; close может прийти из другого потока
+        connection = sqlite3.connect(self.path, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS events ("
+            "id INTEGER PRIMARY KEY, kind TEXT NOT NULL, session_id TEXT NOT NULL, "
+            "timestamp TEXT NOT NULL, data TEXT NOT NULL)"
+        )
+        connection.execute("CREATE INDEX IF NOT EXISTS events_kind_session ON events (kind, session_id)")
+        return connection
+
+    def write_batch(self, events):
+        if self._connection is None:
+            self._connection = self._connect()
+        with self._connection:
+            self._connection.executemany(
+                "INSERT INTO events (kind, session_id, timestamp, data) VALUES (?, ?, ?, ?)",
+                [(event.kind, event.session_id, event.timestamp, event.data) for event in events]
+            )
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def iter_events(self, kinds=None, newest_first=False):
+        if not os.path.exists(self.path):
+            return
+        connection = sqlite3.connect(self.path)
+        try:
+            query = "SELECT id, kind, session_id, timestamp, data FROM events"
+            params = ()
+            if kinds is not None:
+                kinds = list(kinds)
+                query += f" WHERE kind IN ({', '.join('?' * len(kinds))})"
+                params = kinds
+            query += " ORDER BY id DESC" if newest_first else " ORDER BY id"
+            for row_id, kind, session_id, timestamp, data in connection.execute(query, params):
+                yield StoredEvent(kind, session_id, timestamp, json.loads(data), f"sqlite:{self.path}:{row_id}")
+        finally:
+            connection.close()
+
+
+STORES = {
+    'files': (FileEventStore, "."),
+    'jsonl': (JsonlEventStore, EVENTS_DIR),
+    'sqlite': (SqliteEventStore, os.path.join(EVENTS_DIR, "events.db")),
+}
+
+
+def open_event_store(name=EVENT_STORE, path=EVENT_PATH):
+    """Хранилище событий по имени; path по умолчанию — стандартное место для него"""
+    if name not in STORES:
+        raise ValueError(f"Неизвестное хранилище событий '{name}', доступны: {', '.join(STORES)}")
+    store_class, default_path = STORES[name]
+    return store_class(path or default_path)
+
+
+def iter_stored_events(kinds=None, newest_first=False, store=None):
+    """События хранилища и, если оно не files, события из прежней раскладки файлов"""
+    store = store or open_event_store()
+    sources = [store]
+    if not isinstance(store, FileEventStore):
+        # Прежние файлы старше журнала: при обходе от новых к старым они идут последними
+        sources = [store, FileEventStore()] if newest_first else [FileEventStore(), store]
+    for source in sources:
+        yield from source.iter_events(kinds, newest_first)
+
+
+def read_event(ref):
+    """Данные события по ссылке ref из iter_events"""
+    scheme, _, location = ref.partition(':')
+    if scheme == 'file':
+        with open(location, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    path, _, position = location.rpartition(':')
+    if scheme == 'jsonl':
+        with open(path, 'rb') as f:
+            f.seek(int(position))
+            return json.loads(f.readline())['data']
+    if scheme == 'sqlite':
+        connection = sqlite3.connect(path)
+        try:
+            row = connection.execute("SELECT data FROM events WHERE id = ?", (int(position),)).fetchone()
+        finally:
+            connection.close()
+        if row is None:
+            raise KeyError(ref)
+        return json.loads(row[0])
+    raise ValueError(f"Неизвестная ссылка на событие: {ref}")
+
+
+class EventWriter:
+    """Фоновая запись событий пачками.
+
+    append только сериализует событие и кладёт его в очередь. Поток писателя
+    берёт первое событие, ждёт ещё до flush_ms или до batch_size событий и
+    записывает всю пачку одним обращением к хранилищу.
+    """
+
+    def __init__(self, store, batch_size=EVENT_BATCH_SIZE, flush_ms=EVENT_FLUSH_MS, max_queue=EVENT_QUEUE_SIZE,
+                 retries=EVENT_RETRIES, retry_backoff=EVENT_RETRY_BACKOFF, spill_path=EVENT_SPILL_PATH):
+        self.store = store
+        self.batch_size = batch_size
+        self.flush_interval = flush_ms / 1000
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.spill_path = spill_path
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._lock = threading.Lock()
+        self.written = 0
+        self.batches = 0
+        self.failed = 0
+        self.retried = 0
+        self.spilled = 0
+        self.max_batch = 0
+
+    def append(self, kind, session_id, data, timestamp=None):
+        """Ставит событие в очередь на запись; при переполненной очереди ждёт места"""
+        if kind not in LEGACY_LAYOUT:
+            raise ValueError(f"Неизвестный вид события '{kind}'")
+        timestamp = timestamp or datetime.now().strftime(TIMESTAMP_FORMAT)
+        event = PendingEvent(kind, str(session_id), timestamp, self.store.serialize(data))
+        self._start()
+        self._queue.put(event)
+
+    def flush(self):
+        """Ждёт, пока все поставленные события будут записаны"""
+        if self._thread is not None:
+            self._queue.join()
+
+    def stats(self):
+        return {'store': self.store.name, 'queued': self._queue.qsize(), 'written': self.written,
+                'batches': self.batches, 'failed': self.failed, 'retried': self.retried,
+                'spilled': self.spilled, 'max_batch': self.max_batch}
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                thread = threading.Thread(target=self._run, name="event-writer", daemon=True)
+                thread.start()
+                self._thread = thread
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                self._write_with_retries(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write_with_retries(self, batch):
+        """Пишет пачку, повторяя с растущей паузой; не записанную пачку откладывает в spill_path"""
+        delay = self.retry_backoff
+        for attempt in range(self.retries + 1):
+            try:
+                self.store.write_batch(batch)
+            except Exception as e:
+                logger.error(f"Ошибка записи {len(batch)} событий в {self.store.name} "
+                             f"(попытка {attempt + 1} из {self.retries + 1}): {str(e)}")
+                if attempt < self.retries:
+                    self.retried += 1
+                    time.sleep(delay)
+                    delay *= 2
+                continue
+            self.written += len(batch)
+            self.batches += 1
+            self.max_batch = max(self.max_batch, len(batch))
+            return
+        self._spill(batch)
+
+    def _spill(self, batch):
+        """Дописывает пачку в запасной файл jsonl, чтобы события не пропали"""
+        try:
+            directory = os.path.dirname(self.spill_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.spill_path, 'ab') as f:
+                # Недописанную строку от прошлой ошибки закрываем, чтобы не склеить записи
+                if f.tell() > 0:
+                    with open(self.spill_path, 'rb') as tail:
+                        tail.seek(-1, os.SEEK_END)
+                        if tail.read(1) != b"\n":
+                            f.write(b"\n")
+                f.write(b"".join(jsonl_line(event) for event in batch))
+            self.spilled += len(batch)
+            logger.error(f"{len(batch)} событий отложены в {self.spill_path}")
+        except Exception as e:
+            self.failed += len(batch)
+            logger.error(f"Не удалось отложить {len(batch)} событий в {self.spill_path}: {str(e)}")
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_event_writer():
+    """Общий для процесса писатель событий; очередь дописывается при выходе из процесса"""
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = EventWriter(open_event_store())
+                atexit.register(_writer.flush)
+    return _writer
@@ -0,0 +1,199 @@
+"""Общий для процесса сервис оценки анкет с микропакетами.
+
+Streamlit обслуживает каждую сессию в своём потоке; если каждая сессия
+сама вызывает predict, потоки толкаются за GIL ради множества мелких
+вызовов. Здесь сессии только ставят запрос в очередь и ждут Future, а один
+поток сервиса берёт первый запрос, ждёт ещё до BEAUTY_BATCH_WINDOW_MS или
+до BEAUTY_BATCH_MAX_SIZE запросов и оценивает всю пачку одним вызовом
+mod.predict_batch. Результаты возвращаются каждому вызывающему через его
+Future, в том же виде, что у predict_for_multiple_problems.
+
+BEAUTY_BATCHING=0 выключает сервис: predict() вызывает модель прямо в
+потоке вызывающего.
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+BATCHING_ENABLED = os.environ.get("BEAUTY_BATCHING", "1") != "0"
+BATCH_WINDOW_MS = float(os.environ.get("BEAUTY_BATCH_WINDOW_MS", "2"))
+BATCH_MAX_SIZE = int(os.environ.get("BEAUTY_BATCH_MAX_SIZE", "64"))
+
+
+class BatchingPredictor:
+    """Очередь запросов predict_for_multiple_problems, которые оцениваются пачками.
+
+    submit кладёт запрос в очередь и сразу возвращает Future. Поток сервиса
+    берёт первый запрос, ждёт ещё до window_ms или до max_batch_size
+    запросов и передаёт пачку в predict (по умолчанию mod.predict_batch).
+    """
+
+    def __init__(self, window_ms=BATCH_WINDOW_MS, max_batch_size=BATCH_MAX_SIZE, predict=None):
+        self.window = window_ms / 1000
+        self.max_batch_size = max(1, max_batch_size)
+        self._predict = predict
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._batch_sizes = Counter()
+        self.requests = 0
+        self.batches = 0
+        self.failed = 0
+        self.wait_seconds = 0.0
+        self.predict_seconds = 0.0
+
+    def submit(self, request):
+        """Ставит запрос (аргументы predict_for_multiple_problems) в очередь; возвращает Future"""
+        future = Future()
+        self._start()
+        self._queue.put((request, future, time.perf_counter()))
+        return future
+
+    def predict(self, request, timeout=None):
+        """Результат для одного запроса, как у predict_for_multiple_problems"""
+        return self.submit(request).result(timeout)
+
+    def stats(self):
+        """Счётчики и распределение размеров пачек"""
+        with self._lock:
+            sizes = sorted(self._batch_sizes.items())
+            return {
+                'window_ms': self.window * 1000,
+                'max_batch_size': self.max_batch_size,
+                'queued': self._queue.qsize(),
+                'requests': self.requests,
+                'batches': self.batches,
+                'failed': self.failed,
+                'mean_batch_size': round(self.requests / self.batches, 2) if self.batches else 0.0,
+                'p50_batch_size': _counter_quantile(sizes, self.batches, 0.5),
+                'p95_batch_size': _counter_quantile(sizes, self.batches, 0.95),
+                'max_batch_size_seen': sizes[-1][0] if sizes else 0,
+                'batch_sizes': dict(sizes),
+                'mean_wait_ms': round(self.wait_seconds / self.requests * 1000, 3) if self.requests else 0.0,
+                'mean_predict_ms': round(self.predict_seconds / self.batches * 1000, 3) if self.batches else 0.0
+            }
+
+    def stop(self):
+        """Дорабатывает уже поставленные запросы и останавливает поток"""
+        thread = self._thread
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+            self._thread = None
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                thread = threading.Thread(target=self._run, name="inference-batcher", daemon=True)
+                thread.start()
+                self._thread = thread
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = time.perf_counter() + self.window
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                try:
+                    # После окна забираем только то, что уже лежит в очереди
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        if self._predict is None:
+            from mod import predict_batch
+            self._predict = predict_batch
+        # Отменённые вызывающим запросы не оцениваем
+        batch = [item for item in batch if item[1].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        started = time.perf_counter()
+        try:
+            results = self._predict([request for request, _, _ in batch])
+        except Exception as e:
+            logger.error(f"Ошибка оценки пачки из {len(batch)} запросов: {str(e)}")
+            if len(batch) == 1:
+                results = [e]
+            else:
+                # Ошибка одного запроса не должна доставаться соседям по пачке:
+                # оцениваем запросы по одному, каждый Future получает свой итог
+                results = [self._predict_one(request) for request, _, _ in batch]
+        finished = time.perf_counter()
+        failed = 0
+        for (_, future, _), result in zip(batch, results):
+            if isinstance(result, Exception):
+                future.set_exception(result)
+                failed += 1
+            else:
+                future.set_result(result)
+        with self._lock:
+            self.failed += failed
+            self.requests += len(batch)
+            self.batches += 1
+            self._batch_sizes[len(batch)] += 1
+            self.wait_seconds += sum(started - queued_at for _, _, queued_at in batch)
+            self.predict_seconds += finished - started
+
+
+    def _predict_one(self, request):
+        """Результат одного запроса или исключение, с которым он упал"""
+        try:
+            return self._predict([request])[0]
+        except Exception as e:
+            logger.error(f"Ошибка оценки запроса: {str(e)}")
+            return e
+
+
+def _counter_quantile(items, total, q):
+    """Квантиль по отсортированным парам (значение, число) без разворачивания в список"""
+    if not total:
+        return 0
+    rank = min(total - 1, int(total * q))
+    seen = 0
+    for value, count in items:
+        seen += count
+        if seen > rank:
+            return value
+    return items[-1][0]
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_inference_service():
+    """Общий для процесса сервис оценки; поток останавливается при выходе из процесса"""
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = BatchingPredictor()
+                atexit.register(_service.stop)
+    return _service
+
+
+def predict(request):
+    """Рекомендации по запросу predict_for_multiple_problems через общий сервис (или напрямую)"""
+    if not BATCHING_ENABLED:
+        from mod import predict_batch
+        return predict_batch([request])[0]
+    return get_inference_service().predict(request)
@@ -0,0 +1,80 @@
+"""Настройка логирования процесса.
+
+Обработчики, которые пишут в файл и в консоль, работают в отдельном потоке
+QueueListener; в потоке запроса остаётся только QueueHandler, который кладёт
+запись в очередь. Файл logs/app.log ротируется по размеру.
+
+Подробности по отдельным шаблонам и симптомам пишутся на уровне DEBUG с
+ленивым форматированием; на уровне INFO вместо них выводится одна сводная
+строка на запрос, и то лишь для доли запросов BEAUTY_LOG_SAMPLE_RATE.
+"""
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+
+LOG_DIR = "logs"
+LOG_FILE = os.path.join(LOG_DIR, "app.log")
+LOG_LEVEL = os.environ.get("BEAUTY_LOG_LEVEL", "INFO").upper()
+LOG_MAX_BYTES = int(float(os.environ.get("BEAUTY_LOG_MAX_MB", "10")) * 1024 * 1024)
+LOG_BACKUP_COUNT = int(os.environ.get("BEAUTY_LOG_BACKUPS", "5"))
+LOG_SAMPLE_RATE = float(os.environ.get("BEAUTY_LOG_SAMPLE_RATE", "0.01"))  # доля запросов со сводной строкой
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+_listener = None
+_lock = threading.Lock()
+
+
+def _console_handler():
+    handler = logging.StreamHandler()
+    if sys.stdout.encoding != 'utf-8':
+        try:
+            handler.stream = open(sys.stdout.fileno(), mode='w', encoding='utf-8', buffering=1, closefd=False)
+        except Exception as e:
+            logging.error(f"Failed to set console encoding to UTF-8: {str(e)}")
+    return handler
+
+
+def setup_logging(log_file=LOG_FILE, level=LOG_LEVEL, console=True):
+    """Направляет корневой логгер в очередь; вызывать можно сколько угодно раз.
+
+    Первый вызов в процессе запускает QueueListener с обработчиками файла
+    (RotatingFileHandler) и консоли, повторные только выставляют уровень.
+    log_file=None — без файла (для утилит командной строки).
+    """
+    global _listener
+    root = logging.getLogger()
+    root.setLevel(level)
+    if _listener is not None:
+        return _listener
+    with _lock:
+        if _listener is not None:
+            return _listener
+        formatter = logging.Formatter(LOG_FORMAT)
+        handlers = []
+        if log_file:
+            os.makedirs(os.path.dirname(log_file) or ".", exist_ok=True)
+            handlers.append(logging.handlers.RotatingFileHandler(
+                log_file, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding='utf-8'
+            ))
+        if console:
+            handlers.append(_console_handler())
+        for handler in handlers:
+            handler.setFormatter(formatter)
+
+        log_queue = queue.SimpleQueue()
+        root.handlers = [logging.handlers.QueueHandler(log_queue)]
+        _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
+        return _listener
+
+
+def sampled(rate=None):
+    """Попадает ли текущий запрос в выборку для сводной строки в логе"""
+    rate = LOG_SAMPLE_RATE if rate is None else rate
+    return rate >= 1 or (rate > 0 and random.random() < rate)
@@ -0,0 +1,166 @@
+"""Гистограммы времени по этапам подбора рекомендаций и сборки PDF.
+
+Замеряется только доля вызовов BEAUTY_METRICS_SAMPLE_RATE (по умолчанию 0 —
+выключено). Для вызова вне выборки start_trace() возвращает None, и
+хуки в коде сводятся к проверке `if trace is not None`.
+
+Для вызова в выборке Trace.mark(stage, problem) записывает время с
+предыдущей отметки в гистограмму этапа. Гистограммы копятся в памяти
+процесса с метками stage и problem; percentiles() считает p50/p95/p99 по
+корзинам, prometheus_text() отдаёт их в текстовом формате Prometheus
+(GET /metrics в api.py).
+"""
+import bisect
+import os
+import random
+import threading
+import time
+
+METRICS_SAMPLE_RATE = float(os.environ.get("BEAUTY_METRICS_SAMPLE_RATE", "0"))
+METRICS_MAX_SERIES = int(os.environ.get("BEAUTY_METRICS_MAX_SERIES", "500"))
+# Границы корзин в секундах: от 10 мкс с шагом ×√2, последняя ≈ 7 с
+BUCKET_BOUNDS = tuple(1e-5 * 2 ** (i / 2) for i in range(40))
+QUANTILES = (0.5, 0.95, 0.99)
+OTHER_PROBLEM = "other"  # метка для проблем сверх METRICS_MAX_SERIES
+
+
+class Histogram:
+    """Счётчики по фиксированным корзинам, сумма, минимум и максимум наблюдений"""
+
+    def __init__(self, bounds=BUCKET_BOUNDS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # последняя корзина — больше всех границ
+        self.count = 0
+        self.sum = 0.0
+        self.min = float('inf')
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q):
+        """Оценка квантиля линейной интерполяцией внутри корзины, в пределах [min, max]"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            if bucket_count and seen + bucket_count >= rank:
+                lower = self.bounds[i - 1] if i > 0 else 0.0
+                upper = self.bounds[i] if i < len(self.bounds) else self.max
+                estimate = lower + (upper - lower) * (rank - seen) / bucket_count
+                return min(max(estimate, self.min), self.max)
+            seen += bucket_count
+        return self.max
+
+
+class StageMetrics:
+    """Потокобезопасный набор гистограмм с ключом (этап, проблема)"""
+
+    def __init__(self, max_series=METRICS_MAX_SERIES):
+        self.max_series = max_series
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds, problem=""):
+        key = (stage, problem)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                # Проблемы приходят и от клиентов API: число рядов ограничено
+                if len(self._histograms) >= self.max_series:
+                    key = (stage, OTHER_PROBLEM)
+                    histogram = self._histograms.get(key)
+                if histogram is None:
+                    histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def clear(self):
+        with self._lock:
+            self._histograms.clear()
+
+    def percentiles(self):
+        """{(этап, проблема): {'count', 'sum_ms', 'p50_ms', 'p95_ms', 'p99_ms'}}"""
+        with self._lock:
+            items = sorted(self._histograms.items())
+            summary = {}
+            for key, histogram in items:
+                summary[key] = {'count': histogram.count, 'sum_ms': round(histogram.sum * 1000, 3)}
+                for q in QUANTILES:
+                    summary[key][f"p{round(q * 100)}_ms"] = round(histogram.quantile(q) * 1000, 3)
+            return summary
+
+    def prometheus_text(self, name="beauty_stage_seconds"):
+        """Гистограммы и квантили в текстовом формате Prometheus 0.0.4"""
+        lines = [
+            f"# HELP {name} Время этапов подбора рекомендаций и сборки PDF",
+            f"# TYPE {name} histogram"
+        ]
+        quantile_lines = [
+            f"# HELP {name}_quantile Оценка квантилей по корзинам {name}",
+            f"# TYPE {name}_quantile gauge"
+        ]
+        with self._lock:
+            for (stage, problem), histogram in sorted(self._histograms.items()):
+                labels = f'stage="{_escape(stage)}",problem="{_escape(problem)}"'
+                cumulative = 0
+                for bound, bucket_count in zip(histogram.bounds, histogram.counts):
+                    cumulative += bucket_count
+                    lines.append(f'{name}_bucket{{{labels},le="{bound:.6g}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+                lines.append(f"{name}_sum{{{labels}}} {histogram.sum:.9g}")
+                lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+                for q in QUANTILES:
+                    quantile_lines.append(f'{name}_quantile{{{labels},quantile="{q}"}} {histogram.quantile(q):.9g}')
+        return "\n".join(lines + quantile_lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Trace:
+    """Отметки времени одного вызова; каждая отметка закрывает этап"""
+
+    __slots__ = ('metrics', 'started', 'last')
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self.started = self.last = time.perf_counter()
+
+    def mark(self, stage, problem=""):
+        now = time.perf_counter()
+        self.metrics.observe(stage, now - self.last, problem)
+        self.last = now
+
+    def finish(self, stage, problem=""):
+        """Общее время вызова от start_trace"""
+        now = time.perf_counter()
+        self.metrics.observe(stage, now - self.started, problem)
+        self.last = now
+
+
+_metrics = StageMetrics()
+
+
+def get_metrics():
+    """Гистограммы этапов текущего процесса"""
+    return _metrics
+
+
+def set_sample_rate(rate):
+    """Доля замеряемых вызовов: 0 — выключено, 1 — все"""
+    global METRICS_SAMPLE_RATE
+    METRICS_SAMPLE_RATE = float(rate)
+
+
+def start_trace(rate=None):
+    """Trace для вызова в выборке, иначе None"""
+    rate = METRICS_SAMPLE_RATE if rate is None else rate
+    if rate <= 0 or (rate < 1 and random.random() >= rate):
+        return None
+    return Trace(_metrics)
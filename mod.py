@@ -1,11 +1,15 @@
-import pandas as pd
-import joblib
-import json
+import numpy as np
 import os
+import time
 import logging
+from registry import get_registry
+from native_model import NativeRegressor
+from cache import LRUCache
+from catalog import method_complexity_map  # прежнее место словаря, для совместимости импортов
+from logging_setup import sampled
+from metrics import start_trace
 
-# Настройка логирования
-logging.basicConfig(level=logging.INFO)
+# Обработчики логов настраивает вызывающая сторона (logging_setup.setup_logging)
 logger = logging.getLogger(__name__)
 
 import os
@@ -14,15 +18,10 @@ MODEL_DIR = "models"  # Папка models в корне репозитория
 TEMPLATES_PATH = os.path.join(MODEL_DIR, "valid_templates.json")
 REGRESSOR_PATH = os.path.join(MODEL_DIR, "best_regressor_tuned_pipeline.pkl")
 
-# Словарь для вычисления method_complexity
-method_complexity_map = {
-    "Уходовая косметика": 1,
-    "Пилинги": 2,
-    "Массаж": 2,
-    "Тейпирование": 2,
-    "Аппаратная косметология": 3,
-    "Инъекционная косметология": 5
-}
+# Кэш готовых рекомендаций по одной проблеме; ключ включает версию модели,
+# поэтому после горячей замены модели старые записи просто перестают находиться
+RECOMMENDATION_CACHE_SIZE = int(os.environ.get("BEAUTY_RECOMMENDATION_CACHE_SIZE", "4096"))
+recommendation_cache = LRUCache(RECOMMENDATION_CACHE_SIZE)
 
 def list_to_text(x):
     """Преобразует список симптомов в строку, разделённую пробелами"""
@@ -31,151 +30,309 @@ def list_to_text(x):
     return str(x)  # На случай, если передали уже строку
 
 def load_models_and_templates():
-    """Загружает регрессорный пайплайн и шаблоны с проверкой"""
-    required_files = {
-        "regressor_pipeline": "best_regressor_tuned_pipeline.pkl",
-        "templates": "valid_templates.json"
+    """Возвращает регрессорный пайплайн и шаблоны из общего реестра процесса"""
+    snapshot = get_registry().get()
+    return snapshot.regressor, snapshot.templates
+
+def get_model_version():
+    """Версия загруженных модели и шаблонов (по контрольным суммам файлов)"""
+    return get_registry().version
+
+def _recommendation_key(version, problem, skin_type, age_range, symptoms_str,
+                        user_allergies, user_contraindications, is_pregnant, top_n):
+    """Ключ кэша рекомендаций: порядок симптомов важен для модели, порядок аллергий и противопоказаний — нет"""
+    return (
+        version, problem, skin_type, age_range, symptoms_str,
+        tuple(sorted(set(user_allergies or ()))),
+        tuple(sorted(set(user_contraindications or ()))),
+        bool(is_pregnant), top_n
+    )
+
+def _predict(regressor, rows):
+    """Предсказание для таблицы, заданной словарём столбцов"""
+    if isinstance(regressor, NativeRegressor):
+        return regressor.predict(rows)
+    import pandas as pd  # нужен только sklearn-пайплайну
+    return regressor.predict(pd.DataFrame(rows))
+
+def _problem_candidates(catalog, problem, skin_type, age_range):
+    """Отбирает номера шаблонов для проблемы; при ошибке возвращает словарь с описанием.
+
+    Обязательные поля шаблонов проверены при сборке каталога (catalog.validate_templates).
+    """
+    # Строгая фильтрация шаблонов по проблеме, типу кожи и возрастному диапазону (по индексу каталога)
+    template_ids = catalog.candidate_ids(problem, skin_type, age_range)
+    if not template_ids:
+        return {"error": f"Нет шаблонов для проблемы '{problem}' с типом кожи '{skin_type}' и возрастным диапазоном '{age_range}'"}
+    return template_ids
+
+def apply_corrections(catalog, template_ids, base_probs, user_allergies=None,
+                      user_contraindications=None, is_pregnant=False):
+    """Корректирует базовые вероятности сразу для всей пачки шаблонов"""
+    template_ids = np.asarray(template_ids, dtype=np.intp)
+    probs = np.asarray(base_probs, dtype=np.float64)
+
+    # Аллергии на компоненты
+    if user_allergies:
+        probs = np.where(catalog.allergy_hits(template_ids, user_allergies), probs * 0.6, probs)
+
+    # Беременность
+    if is_pregnant:
+        probs = np.where(catalog.pregnancy_flags[template_ids], probs * 0.7, probs)
+
+    # Противопоказания
+    if user_contraindications:
+        probs = np.where(catalog.contraindication_hits(template_ids, user_contraindications), probs * 0.8, probs)
+
+    return np.maximum(probs, 0.1)  # Минимум 10%
+
+def select_top_distinct(scores, method_codes, top_n):
+    """Позиции top_n лучших кандидатов с разными методами.
+
+    Эквивалентно проходу по кандидатам, отсортированным по убыванию оценки
+    (при равенстве — в исходном порядке), с пропуском уже встречавшихся методов.
+    """
+    order = np.argsort(-np.asarray(scores), kind='stable')
+    # Первое вхождение каждого метода в порядке ранжирования — лучший кандидат этого метода
+    _, first_positions = np.unique(np.asarray(method_codes)[order], return_index=True)
+    return order[np.sort(first_positions)[:top_n]]
+
+def _build_result(template, final_prob, base_prob):
+    """Словарь рекомендации для отображения; строится только для отобранных шаблонов"""
+    result = {
+        'method': template['method'],
+        'type': template['type'],
+        'success_prob': final_prob,
+        'template': template.get('template', 'Описание отсутствует'),
+        'expected_effect': ', '.join(template.get('effects', ['Не указан'])),
+        'course_duration': str(template.get('course_duration', 'Не указана')),
+        'active_ingredients': template.get('active_ingredients', []),
+        'contraindications': template.get('contraindications', 'Нет').split('\n'),
+        'base_prob': base_prob,
+        'template_id': template.get('template_id')
     }
     
-    missing = [name for name, fname in required_files.items() 
-               if not os.path.exists(os.path.join(MODEL_DIR, fname))]
-    if missing:
-        raise FileNotFoundError(f"Отсутствуют файлы: {missing}")
+    if final_prob < 30:
+        result['warning'] = "Низкая эффективность из-за противопоказаний"
+    return result
 
-    # Загружаем полный пайплайн регрессора
-    regressor_pipeline = joblib.load(os.path.join(MODEL_DIR, required_files["regressor_pipeline"]))
+def _rank_recommendations(problem, catalog, template_ids, predictions,
+                          user_allergies, user_contraindications, is_pregnant, top_n, trace=None):
+    """Применяет корректировки к предсказаниям и выбирает топ-N шаблонов с разными методами"""
+    ids = np.asarray(template_ids, dtype=np.intp)
+    base_probs = np.minimum(predictions, 0.95)  # Макс 95%
+    # Конвертируем в проценты и округляем до целого
+    final_probs = np.round(apply_corrections(
+        catalog, ids, base_probs, user_allergies, user_contraindications, is_pregnant
+    ) * 100, 0)
+    if trace is not None:
+        trace.mark('corrections', problem)
+
+    # Ранжируем по массивам оценок и собираем словари только для победителей
+    winners = select_top_distinct(final_probs, catalog.method_codes[ids], max(top_n, 1))
+    top_recommendations = [
+        _build_result(catalog.template(ids[i]), float(final_probs[i]), float(np.round(base_probs[i], 2)))
+        for i in winners
+    ]
+    if trace is not None:
+        trace.mark('ranking', problem)
     
-    with open(os.path.join(MODEL_DIR, required_files["templates"]), 'r', encoding='utf-8') as f:
-        templates = json.load(f)
+    if not top_recommendations:
+        return {"error": f"Не удалось найти рекомендации для проблемы: {problem}"}
     
-    return regressor_pipeline, templates
+    return {
+        'problem': problem,
+        'recommendations': top_recommendations
+    }
 
 def get_top_recommendations(problem, skin_type, age_range, symptoms,
                           user_allergies=None, user_contraindications=None, 
                           is_pregnant=False, top_n=3):
-    try:
-        regressor_pipeline, templates = load_models_and_templates()
-        
-        # Строгая фильтрация шаблонов по проблеме, типу кожи и возрастному диапазону
-        problem_templates = [
-            t for t in templates 
-            if (t['problem'].replace("ё", "е").lower() == problem.replace("ё", "е").lower() and
-                t['skin_type'] == skin_type and
-                t['age_range'] == age_range)  # Только точное совпадение
-        ]
-        if not problem_templates:
-            return {"error": f"Нет шаблонов для проблемы '{problem}' с типом кожи '{skin_type}' и возрастным диапазоном '{age_range}'"}
-
-        results = []
-        seen_methods = set()  # Для выбора разных методов
-        for template in problem_templates:
-            method = template['method']
-            treatment_type = template['type']
-            
-            # Проверяем наличие обязательных полей в шаблоне
-            required_fields = ['method', 'type']
-            missing_fields = [field for field in required_fields if field not in template]
-            if missing_fields:
-                return {"error": f"В шаблоне для проблемы '{problem}' отсутствуют обязательные поля: {missing_fields}"}
-
-            # Вычисляем method_complexity на основе method
-            method_complexity = method_complexity_map.get(method, 1)  # По умолчанию 1, если метод не найден
-
-            # Подготовка входных данных для регрессора
-            symptoms_str = list_to_text(symptoms)  # Преобразуем симптомы в строку
-            logger.info(f"symptoms_str: {symptoms_str}")
-            input_df_reg = pd.DataFrame({
-                'problem': [problem],
-                'skin_type': [skin_type],
-                'age_range': [age_range],
-                'symptoms_str': [symptoms_str],  # Используем правильное имя столбца
-                'method': [method],
-                'type': [treatment_type],
-                'method_complexity': [method_complexity]
-            })
-            logger.info(f"input_df_reg columns: {input_df_reg.columns.tolist()}")
-            logger.info(f"input_df_reg data: {input_df_reg.to_dict()}")
-
-            # Предсказываем базовую вероятность с помощью пайплайна
-            base_prob = min(regressor_pipeline.predict(input_df_reg)[0], 0.95)  # Макс 95%
-
-            # Применяем корректировки
-            def apply_corrections(prob):
-                # Аллергии на компоненты
-                if user_allergies and any(a.replace("Аллергия на ", "").lower() in [ing.lower() for ing in template.get('active_ingredients', [])] for a in user_allergies):
-                    prob *= 0.6
-                    
-                # Беременность
-                if is_pregnant and template.get('contraindicated_during_pregnancy', False):
-                    prob *= 0.7
-                    
-                # Противопоказания
-                if user_contraindications and any(c.lower() in template.get('contraindications', '').lower() for c in user_contraindications):
-                    prob *= 0.8
-                    
-                return max(prob, 0.1)  # Минимум 10%
-
-            final_prob = round(apply_corrections(base_prob) * 100, 0)  # Конвертируем в проценты и округляем до целого
-
-            # Формируем результат
-            result = {
-                'method': method,
-                'type': treatment_type,
-                'success_prob': final_prob,
-                'template': template.get('template', 'Описание отсутствует'),
-                'expected_effect': ', '.join(template.get('effects', ['Не указан'])),
-                'course_duration': str(template.get('course_duration', 'Не указана')),
-                'active_ingredients': template.get('active_ingredients', []),
-                'contraindications': template.get('contraindications', 'Нет').split('\n'),
-                'base_prob': round(base_prob, 2)
-            }
-            
-            if final_prob < 30:
-                result['warning'] = "Низкая эффективность из-за противопоказаний"
-                
-            results.append(result)
-
-        # Сортируем по вероятности и выбираем топ-N с разными методами
-        top_recommendations = []
-        sorted_results = sorted(results, key=lambda x: -x['success_prob'])
-        for result in sorted_results:
-            if result['method'] not in seen_methods:
-                seen_methods.add(result['method'])
-                top_recommendations.append(result)
-                if len(top_recommendations) >= top_n:
-                    break
-        
-        if not top_recommendations:
-            return {"error": f"Не удалось найти рекомендации для проблемы: {problem}"}
-        
-        return {
-            'problem': problem,
-            'recommendations': top_recommendations
-        }
-
-    except Exception as e:
-        logger.error(f"Ошибка в get_top_recommendations: {str(e)}")
-        return {"error": f"Ошибка при формировании рекомендаций: {str(e)}"}
+    """Возвращает топ-N рекомендаций для одной проблемы"""
+    return predict_for_multiple_problems(
+        problems=[problem],
+        skin_type=skin_type,
+        age_range=age_range,
+        symptoms=symptoms,
+        user_allergies=user_allergies,
+        user_contraindications=user_contraindications,
+        is_pregnant=is_pregnant,
+        top_per_problem=top_n
+    )[0]
     
 def predict_for_multiple_problems(problems, skin_type, age_range, symptoms,
                                 user_allergies=None, user_contraindications=None,
                                 is_pregnant=False, top_per_problem=3):
-    """Обрабатывает несколько проблем и возвращает рекомендации для каждой"""
-    if isinstance(problems, str):
-        problems = [problems]
-        
-    all_results = []
-    for problem in problems:
-        result = get_top_recommendations(
-            problem=problem,
-            skin_type=skin_type,
-            age_range=age_range,
-            symptoms=symptoms,
-            user_allergies=user_allergies,
-            user_contraindications=user_contraindications,
-            is_pregnant=is_pregnant,
-            top_n=top_per_problem
+    """Обрабатывает несколько проблем и возвращает рекомендации для каждой.
+
+    Кандидаты всех проблем собираются в одну таблицу и оцениваются
+    одним вызовом predict регрессора. Готовые результаты берутся из кэша
+    recommendation_cache и не должны изменяться вызывающим кодом.
+    """
+    return predict_batch([{
+        'problems': problems,
+        'skin_type': skin_type,
+        'age_range': age_range,
+        'symptoms': symptoms,
+        'user_allergies': user_allergies,
+        'user_contraindications': user_contraindications,
+        'is_pregnant': is_pregnant,
+        'top_per_problem': top_per_problem
+    }])[0]
+
+def _error_result(e):
+    return {"error": f"Ошибка при формировании рекомендаций: {str(e)}"}
+
+def _problem_block(snapshot, problem, skin_type, age_range, symptoms_str, template_ids):
+    """Признаки кандидатов одной проблемы: матрица NativeRegressor или таблица столбцов для sklearn"""
+    if snapshot.template_features is not None:
+        return snapshot.regressor.request_features(snapshot.template_features, template_ids, problem, symptoms_str)
+    metas = [snapshot.catalog.meta[template_id] for template_id in template_ids]
+    return {
+        'problem': [problem] * len(template_ids),
+        'skin_type': [skin_type] * len(template_ids),
+        'age_range': [age_range] * len(template_ids),
+        'symptoms_str': [symptoms_str] * len(template_ids),
+        'method': [template['method'] for template in metas],
+        'type': [template['type'] for template in metas],
+        'method_complexity': [snapshot.catalog.method_complexity[i] for i in template_ids]
+    }
+
+def _predict_blocks(regressor, blocks):
+    """Предсказания для каждого блока одним вызовом модели.
+
+    Если общий вызов не удался, блоки оцениваются по отдельности, и
+    ошибка (объект исключения на месте массива) достаётся только тем, на
+    которых модель действительно падает.
+    """
+    try:
+        if isinstance(blocks[0], dict):
+            logger.debug("input_df_reg: %s", blocks)
+            rows = {column: [value for block in blocks for value in block[column]] for column in blocks[0]}
+            predictions = _predict(regressor, rows)
+        else:
+            predictions = regressor.predict_features(np.concatenate(blocks))
+    except Exception as e:
+        if len(blocks) == 1:
+            return [e]
+        return [_predict_blocks(regressor, [block])[0] for block in blocks]
+    results = []
+    offset = 0
+    for block in blocks:
+        size = len(block['problem']) if isinstance(block, dict) else len(block)
+        results.append(predictions[offset:offset + size])
+        offset += size
+    return results
+
+def predict_batch(requests):
+    """То же, что predict_for_multiple_problems, сразу для пачки анкет.
+
+    requests — список словарей с аргументами predict_for_multiple_problems.
+    Кандидаты всех анкет оцениваются одним вызовом predict; результат —
+    список результатов в порядке запросов. С NumPy-моделью строки признаков
+    собираются из заранее посчитанных признаков шаблонов и кэшированного
+    вектора симптомов (NativeRegressor.request_features), без таблицы столбцов.
+
+    Ошибка одной проблемы (некорректное значение, сбой отбора или модели)
+    даёт словарь с ошибкой только для неё, как при обработке проблем по
+    одной; остальные проблемы и анкеты пачки оцениваются как обычно.
+
+    Для вызовов в выборке metrics время этапов (загрузка, кэш, отбор
+    шаблонов, признаки, predict, корректировки, ранжирование) пишется
+    в гистограммы metrics.get_metrics().
+    """
+    started = time.perf_counter()
+    trace = start_trace()
+    requests = [dict(request, problems=[request['problems']] if isinstance(request['problems'], str)
+                     else request['problems']) for request in requests]
+    cache_hits = 0
+
+    try:
+        snapshot = get_registry().get()
+    except Exception as e:
+        logger.error(f"Ошибка в predict_for_multiple_problems: {str(e)}")
+        return [[_error_result(e) for _ in request['problems']] for request in requests]
+    if trace is not None:
+        trace.mark('load')
+
+    # Для каждой проблемы каждой анкеты — готовый результат (из кэша или ошибка)
+    # либо номер блока признаков её кандидатов в общем вызове модели
+    slots = []
+    blocks = []
+    n_rows = 0
+    for request in requests:
+        skin_type, age_range = request['skin_type'], request['age_range']
+        symptoms_str = list_to_text(request['symptoms'])  # Преобразуем симптомы в строку
+        logger.debug("symptoms_str: %s", symptoms_str)
+        for problem in request['problems']:
+            cache_key = None
+            try:
+                cache_key = _recommendation_key(
+                    snapshot.version, problem, skin_type, age_range, symptoms_str,
+                    request.get('user_allergies'), request.get('user_contraindications'),
+                    request.get('is_pregnant', False), request.get('top_per_problem', 3)
+                )
+                cached = recommendation_cache.get(cache_key)
+                if trace is not None:
+                    trace.mark('cache_lookup', problem)
+                if cached is not None:
+                    slots.append((cached, None, None))
+                    cache_hits += 1
+                    continue
+                template_ids = _problem_candidates(snapshot.catalog, problem, skin_type, age_range)
+                if trace is not None:
+                    trace.mark('filter', problem)
+                if isinstance(template_ids, dict):
+                    recommendation_cache.put(cache_key, template_ids)
+                    slots.append((template_ids, None, None))
+                    continue
+                block = _problem_block(snapshot, problem, skin_type, age_range, symptoms_str, template_ids)
+                if trace is not None:
+                    trace.mark('features', problem)
+            except Exception as e:
+                logger.error(f"Ошибка в get_top_recommendations: {str(e)}")
+                slots.append((_error_result(e), None, None))
+                continue
+            slots.append((len(blocks), template_ids, cache_key))
+            blocks.append(block)
+            n_rows += len(template_ids)
+
+    # Предсказываем базовые вероятности одним вызовом пайплайна
+    predictions = _predict_blocks(snapshot.regressor, blocks) if blocks else []
+    if trace is not None and n_rows:
+        trace.mark('predict')
+
+    batch_results = []
+    slot_iter = iter(slots)
+    for request in requests:
+        all_results = []
+        for problem in request['problems']:
+            result, template_ids, cache_key = next(slot_iter)
+            if template_ids is None:
+                all_results.append(result)
+                continue
+            problem_predictions = predictions[result]
+            try:
+                if isinstance(problem_predictions, Exception):
+                    raise problem_predictions
+                result = _rank_recommendations(
+                    problem, snapshot.catalog, template_ids, problem_predictions,
+                    request.get('user_allergies'), request.get('user_contraindications'),
+                    request.get('is_pregnant', False), request.get('top_per_problem', 3), trace
+                )
+                recommendation_cache.put(cache_key, result)
+            except Exception as e:
+                logger.error(f"Ошибка в get_top_recommendations: {str(e)}")
+                result = _error_result(e)
+            all_results.append(result)
+        batch_results.append(all_results)
+
+    if trace is not None:
+        trace.finish('recommend_total')
+    if sampled():
+        logger.info(
+            "Рекомендации: %d анкет, %d проблем (%d из кэша), %d строк модели, %.1f мс",
+            len(requests), len(slots), cache_hits, n_rows,
+            (time.perf_counter() - started) * 1000
         )
-        all_results.append(result)
-    
-    return all_results
\ No newline at end of file
+    return batch_results
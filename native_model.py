@@ -0,0 +1,392 @@
+"""Вычисление регрессорного пайплайна на чистом NumPy.
+
+Обученный пайплайн (OneHotEncoder + CountVectorizer/TruncatedSVD + StandardScaler
++ GradientBoostingRegressor) экспортируется в набор плоских массивов и
+сохраняется в .npz. Для предсказаний после этого не нужны sklearn, pandas и pickle.
+
+Запуск из командной строки:
+    python native_model.py export   # собрать models/regressor_native.npz
+    python native_model.py check    # сверить предсказания со sklearn
+    python native_model.py bench    # сравнить скорость со sklearn
+"""
+import hashlib
+import os
+import re
+import sys
+import threading
+import time
+
+import numpy as np
+
+from cache import LRUCache
+
+FORMAT_VERSION = 1
+MODEL_DIR = "models"
+PIPELINE_PATH = os.path.join(MODEL_DIR, "best_regressor_tuned_pipeline.pkl")
+NATIVE_PATH = os.path.join(MODEL_DIR, "regressor_native.npz")
+
+CAT_COLUMNS = ['problem', 'skin_type', 'age_range', 'method', 'type']
+TEXT_COLUMN = 'symptoms_str'
+NUM_COLUMN = 'method_complexity'
+# Признаки, которые у шаблона не зависят от анкеты (problem берётся из запроса)
+TEMPLATE_CAT_COLUMNS = CAT_COLUMNS[1:]
+EMBEDDING_CACHE_SIZE = int(os.environ.get("BEAUTY_EMBEDDING_CACHE_SIZE", "4096"))
+
+
+def compile_pipeline(pipeline, source_sha256=""):
+    """Переводит обученный sklearn-пайплайн в словарь NumPy-массивов.
+
+    Поддерживается ровно та структура, с которой обучалась модель; при любом
+    расхождении выбрасывается ValueError, чтобы не получить молча другие числа.
+    """
+    preprocessor = pipeline.named_steps['preprocessor']
+    regressor = pipeline.named_steps['regressor']
+
+    transformers = [(name, columns) for name, _, columns in preprocessor.transformers_ if name != 'remainder']
+    if transformers != [('cat', CAT_COLUMNS), ('text', TEXT_COLUMN), ('num', [NUM_COLUMN])]:
+        raise ValueError(f"Неподдерживаемая структура ColumnTransformer: {transformers}")
+
+    encoder = preprocessor.named_transformers_['cat']
+    if encoder.drop is not None or encoder.handle_unknown != 'ignore':
+        raise ValueError("OneHotEncoder должен быть с drop=None и handle_unknown='ignore'")
+
+    text = preprocessor.named_transformers_['text']
+    vectorizer = text.named_steps['vectorize']
+    svd = text.named_steps['svd']
+    if (vectorizer.analyzer != 'word' or vectorizer.preprocessor is not None or vectorizer.tokenizer is not None
+            or vectorizer.strip_accents is not None or vectorizer.stop_words is not None or vectorizer.binary):
+        raise ValueError("Неподдерживаемые параметры CountVectorizer")
+
+    scaler = preprocessor.named_transformers_['num']
+    if regressor.loss != 'squared_error' or regressor.estimators_.shape[1] != 1:
+        raise ValueError("Поддерживается только GradientBoostingRegressor с squared_error")
+
+    # Категории: значения всех признаков подряд и смещения начала каждого признака
+    categories = [np.asarray(c, dtype=str) for c in encoder.categories_]
+    cat_offsets = np.cumsum([0] + [len(c) for c in categories])
+
+    # Словарь в порядке столбцов матрицы CountVectorizer
+    vocabulary = np.empty(len(vectorizer.vocabulary_), dtype=object)
+    for term, column in vectorizer.vocabulary_.items():
+        vocabulary[column] = term
+
+    # Деревья: массивы узлов, выровненные по самому большому дереву.
+    # В листьях оба потомка указывают на сам лист, поэтому обход фиксированной
+    # глубины для всех деревьев сразу просто остаётся на месте.
+    trees = [estimator.tree_ for estimator in regressor.estimators_[:, 0]]
+    n_trees = len(trees)
+    max_nodes = max(tree.node_count for tree in trees)
+    feature = np.zeros((n_trees, max_nodes), dtype=np.int32)
+    threshold = np.zeros((n_trees, max_nodes), dtype=np.float64)
+    left = np.tile(np.arange(max_nodes, dtype=np.int32), (n_trees, 1))
+    right = left.copy()
+    value = np.zeros((n_trees, max_nodes), dtype=np.float64)
+    for t, tree in enumerate(trees):
+        n = tree.node_count
+        is_split = tree.children_left[:n] != -1
+        feature[t, :n] = np.where(is_split, tree.feature[:n], 0)
+        threshold[t, :n] = np.where(is_split, tree.threshold[:n], 0.0)
+        left[t, :n] = np.where(is_split, tree.children_left[:n], np.arange(n))
+        right[t, :n] = np.where(is_split, tree.children_right[:n], np.arange(n))
+        value[t, :n] = tree.value[:n, 0, 0]
+
+    return {
+        'format_version': np.int64(FORMAT_VERSION),
+        'source_sha256': np.str_(source_sha256),
+        'cat_values': np.concatenate(categories),
+        'cat_offsets': cat_offsets.astype(np.int64),
+        'token_pattern': np.str_(vectorizer.token_pattern),
+        'lowercase': np.bool_(vectorizer.lowercase),
+        'ngram_range': np.asarray(vectorizer.ngram_range, dtype=np.int64),
+        'vocabulary': vocabulary.astype(str),
+        'svd_components': np.ascontiguousarray(svd.components_, dtype=np.float64),
+        'scaler_mean': np.asarray(scaler.mean_ if scaler.with_mean else [0.0], dtype=np.float64),
+        'scaler_scale': np.asarray(scaler.scale_ if scaler.with_std else [1.0], dtype=np.float64),
+        'init_value': np.float64(regressor.init_.constant_.ravel()[0]),
+        'learning_rate': np.float64(regressor.learning_rate),
+        'max_depth': np.int64(max(tree.max_depth for tree in trees)),
+        'tree_feature': feature,
+        'tree_threshold': threshold,
+        'tree_left': left,
+        'tree_right': right,
+        'tree_value': value,
+    }
+
+
+class NativeRegressor:
+    """Лёгкий вычислитель экспортированного пайплайна.
+
+    predict принимает отображение «столбец -> последовательность значений»
+    (словарь списков или DataFrame) и возвращает те же числа, что и sklearn.
+
+    Горячий путь обходится без таблицы: template_features один раз строит
+    признаки шаблонов каталога, а request_features для запроса копирует
+    нужные строки и дописывает в них проблему и SVD-вектор симптомов
+    (embed_symptoms, с кэшем). Матрица та же, что у transform, побитово.
+    """
+
+    def __init__(self, arrays):
+        if int(arrays['format_version']) != FORMAT_VERSION:
+            raise ValueError(f"Неподдерживаемая версия формата: {int(arrays['format_version'])}")
+        self.source_sha256 = str(arrays['source_sha256'])
+
+        cat_values = arrays['cat_values']
+        cat_offsets = arrays['cat_offsets']
+        self._categories = [
+            {value: int(cat_offsets[i]) + j for j, value in enumerate(cat_values[cat_offsets[i]:cat_offsets[i + 1]].tolist())}
+            for i in range(len(CAT_COLUMNS))
+        ]
+        self._n_cat = int(cat_offsets[-1])
+
+        self._token_re = re.compile(str(arrays['token_pattern']))
+        self._lowercase = bool(arrays['lowercase'])
+        self._ngram_range = tuple(int(n) for n in arrays['ngram_range'])
+        self._vocabulary = {term: i for i, term in enumerate(arrays['vocabulary'].tolist())}
+        # Компоненты SVD по строкам-терминам: вклад термина j — это components[:, j]
+        self._term_components = np.ascontiguousarray(arrays['svd_components'].T)
+        self._n_text = self._term_components.shape[1]
+
+        self._scaler_mean = float(arrays['scaler_mean'][0])
+        self._scaler_scale = float(arrays['scaler_scale'][0])
+        self.n_features = self._n_cat + self._n_text + 1
+        self._embedding_cache = LRUCache(EMBEDDING_CACHE_SIZE)
+
+        self._init_value = float(arrays['init_value'])
+        self._learning_rate = float(arrays['learning_rate'])
+        self._max_depth = int(arrays['max_depth'])
+        # Узлы всех деревьев в одном плоском массиве: узел k дерева t имеет номер t * max_nodes + k
+        n_trees, max_nodes = arrays['tree_feature'].shape
+        offsets = (np.arange(n_trees, dtype=np.intp) * max_nodes)[None, :]
+        self._n_trees = n_trees
+        self._roots = offsets
+        self._feature = arrays['tree_feature'].astype(np.intp).ravel()
+        self._threshold = arrays['tree_threshold'].ravel()
+        self._left = (arrays['tree_left'] + offsets.T).astype(np.intp).ravel()
+        self._right = (arrays['tree_right'] + offsets.T).astype(np.intp).ravel()
+        self._value = arrays['tree_value'].ravel()
+
+    @classmethod
+    def from_pipeline(cls, pipeline, source_sha256=""):
+        return cls(compile_pipeline(pipeline, source_sha256))
+
+    @classmethod
+    def load(cls, path=NATIVE_PATH):
+        with np.load(path, allow_pickle=False) as data:
+            return cls({key: data[key] for key in data.files})
+
+    @staticmethod
+    def save(arrays, path=NATIVE_PATH):
+        # Пишем во временный файл и переименовываем, чтобы читатели не увидели половину файла;
+        # имя уникально для процесса и потока, как в DiskLRUCache.put
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, **arrays)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _analyze(self, text):
+        """Токенизация как в CountVectorizer(analyzer='word')"""
+        if self._lowercase:
+            text = text.lower()
+        tokens = self._token_re.findall(text)
+        min_n, max_n = self._ngram_range
+        terms = list(tokens) if min_n == 1 else []
+        for n in range(max(min_n, 2), min(max_n + 1, len(tokens) + 1)):
+            for i in range(len(tokens) - n + 1):
+                terms.append(" ".join(tokens[i:i + n]))
+        return terms
+
+    def embed_text(self, text):
+        """SVD-вектор текста симптомов.
+
+        Суммирование идёт по возрастанию номера термина, как в умножении
+        разреженной матрицы scipy, поэтому результат совпадает побитово.
+        """
+        counts = {}
+        for term in self._analyze(text):
+            column = self._vocabulary.get(term)
+            if column is not None:
+                counts[column] = counts.get(column, 0) + 1
+        embedding = np.zeros(self._n_text, dtype=np.float64)
+        for column in sorted(counts):
+            embedding += counts[column] * self._term_components[column]
+        return embedding
+
+    def embed_symptoms(self, text):
+        """embed_text с кэшем по тексту симптомов.
+
+        Ключ — сама строка, а не множество симптомов: биграммы зависят от
+        порядка слов. Возвращаемый массив общий, изменять его нельзя.
+        """
+        embedding = self._embedding_cache.get(text)
+        if embedding is None:
+            embedding = self.embed_text(text)
+            embedding.setflags(write=False)
+            self._embedding_cache.put(text, embedding)
+        return embedding
+
+    def template_features(self, templates, complexities):
+        """Признаки шаблонов без анкеты: one-hot skin_type, age_range, method, type и сложность.
+
+        templates — словари шаблонов в порядке каталога, complexities —
+        method_complexity для каждого. Столбцы проблемы и текста остаются нулевыми.
+        """
+        n_rows = len(templates)
+        X = np.zeros((n_rows, self.n_features), dtype=np.float64)
+        rows = np.arange(n_rows)
+        for mapping, column in zip(self._categories[1:], TEMPLATE_CAT_COLUMNS):
+            positions = np.fromiter((mapping.get(t.get(column), -1) for t in templates), dtype=np.int64, count=n_rows)
+            known = positions >= 0
+            X[rows[known], positions[known]] = 1.0
+        complexity = np.asarray(complexities, dtype=np.float64)
+        X[:, -1] = (complexity - self._scaler_mean) / self._scaler_scale
+        X.setflags(write=False)
+        return X
+
+    def request_features(self, template_features, template_ids, problem, symptoms_str):
+        """Строки матрицы признаков для шаблонов template_ids одного запроса и проблемы"""
+        X = template_features[np.asarray(template_ids, dtype=np.intp)]  # копия строк
+        position = self._categories[0].get(problem, -1)
+        if position >= 0:
+            X[:, position] = 1.0
+        X[:, self._n_cat:self._n_cat + self._n_text] = self.embed_symptoms(symptoms_str)
+        return X
+
+    def transform(self, columns):
+        """Строит матрицу признаков (n, n_features) в том же порядке, что ColumnTransformer"""
+        n_rows = len(columns[TEXT_COLUMN])
+        X = np.zeros((n_rows, self.n_features), dtype=np.float64)
+
+        rows = np.arange(n_rows)
+        for mapping, column in zip(self._categories, CAT_COLUMNS):
+            positions = np.fromiter((mapping.get(v, -1) for v in columns[column]), dtype=np.int64, count=n_rows)
+            known = positions >= 0
+            X[rows[known], positions[known]] = 1.0
+
+        # Текст симптомов обычно одинаков для всех строк запроса — считаем каждый один раз
+        embeddings = {}
+        for i, text in enumerate(columns[TEXT_COLUMN]):
+            embedding = embeddings.get(text)
+            if embedding is None:
+                embedding = embeddings[text] = self.embed_text(text)
+            X[i, self._n_cat:self._n_cat + self._n_text] = embedding
+
+        complexity = np.asarray(columns[NUM_COLUMN], dtype=np.float64)
+        X[:, -1] = (complexity - self._scaler_mean) / self._scaler_scale
+        return X
+
+    def predict_features(self, X):
+        """Обход всех деревьев сразу для всей пачки строк"""
+        # Деревья sklearn сравнивают признаки во float32
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        n_rows, n_features = X.shape
+        row_offsets = (np.arange(n_rows, dtype=np.intp) * n_features)[:, None]
+        nodes = np.repeat(self._roots, n_rows, axis=0)
+        for _ in range(self._max_depth):
+            values = np.take(X, row_offsets + np.take(self._feature, nodes))
+            go_left = values <= np.take(self._threshold, nodes)
+            nodes = np.where(go_left, np.take(self._left, nodes), np.take(self._right, nodes))
+
+        # Суммируем деревья строго по порядку (add.accumulate последователен), как predict_stages
+        contributions = np.empty((n_rows, self._n_trees + 1), dtype=np.float64)
+        contributions[:, 0] = self._init_value
+        np.multiply(self._learning_rate, np.take(self._value, nodes), out=contributions[:, 1:])
+        return np.add.accumulate(contributions, axis=1)[:, -1]
+
+    def predict(self, columns):
+        if len(columns[TEXT_COLUMN]) == 0:
+            return np.zeros(0, dtype=np.float64)
+        return self.predict_features(self.transform(columns))
+
+
+def file_sha256(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def export(pipeline_path=PIPELINE_PATH, native_path=NATIVE_PATH):
+    """Экспортирует пайплайн из .pkl в .npz рядом с ним"""
+    import joblib
+    arrays = compile_pipeline(joblib.load(pipeline_path), file_sha256(pipeline_path))
+    NativeRegressor.save(arrays, native_path)
+    return native_path
+
+
+def _sample_frame(symptom_texts):
+    """Все строки каталога шаблонов для каждого из переданных текстов симптомов"""
+    import json
+    import pandas as pd
+    from catalog import method_complexity_map
+    with open(os.path.join(MODEL_DIR, "valid_templates.json"), 'r', encoding='utf-8') as f:
+        templates = json.load(f)
+    rows = [
+        {
+            'problem': t['problem'], 'skin_type': t['skin_type'], 'age_range': t['age_range'],
+            'symptoms_str': text, 'method': t['method'], 'type': t['type'],
+            'method_complexity': method_complexity_map.get(t['method'], 1)
+        }
+        for text in symptom_texts for t in templates
+    ]
+    return pd.DataFrame(rows)
+
+
+def _symptom_texts():
+    import json
+    with open(os.path.join(MODEL_DIR, "valid_templates.json"), 'r', encoding='utf-8') as f:
+        templates = json.load(f)
+    symptoms = sorted({t['symptom'] for t in templates})
+    texts = [''] + symptoms
+    texts += [' '.join(symptoms[i:i + 3]) for i in range(0, len(symptoms), 3)]
+    texts.append('неизвестный симптом')
+    return texts
+
+
+def check_parity(pipeline, native, frame):
+    """Максимальное расхождение предсказаний со sklearn на переданной таблице"""
+    expected = pipeline.predict(frame)
+    actual = native.predict(frame)
+    return float(np.max(np.abs(expected - actual))), int(np.sum(expected != actual))
+
+
+def _bench(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return np.median(timings) * 1000
+
+
+def main(argv):
+    command = argv[1] if len(argv) > 1 else 'export'
+    if command == 'export':
+        print(f"Сохранено: {export()}")
+        return 0
+
+    import joblib
+    pipeline = joblib.load(PIPELINE_PATH)
+    native = NativeRegressor.from_pipeline(pipeline)
+    if command == 'check':
+        frame = _sample_frame(_symptom_texts())
+        max_diff, mismatches = check_parity(pipeline, native, frame)
+        print(f"Строк: {len(frame)}, несовпадений: {mismatches}, макс. расхождение: {max_diff:.3g}")
+        return 0 if mismatches == 0 else 1
+    if command == 'bench':
+        frame = _sample_frame(['Шелушение Зуд Потеря упругости'])
+        columns = {column: frame[column].tolist() for column in frame.columns}
+        for size in (1, 10, 100, 1000):
+            sub_frame = frame.iloc[:size]
+            sub_columns = {column: values[:size] for column, values in columns.items()}
+            sklearn_ms = _bench(lambda: pipeline.predict(sub_frame), 20)
+            native_ms = _bench(lambda: native.predict(sub_columns), 20)
+            print(f"{size:>5} строк: sklearn {sklearn_ms:8.3f} мс, numpy {native_ms:8.3f} мс, ускорение x{sklearn_ms / native_ms:.1f}")
+        return 0
+    print(f"Неизвестная команда: {command}")
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,103 @@
+"""Сверка рекомендаций с эталонным набором анкет.
+
+parity_profiles.json хранит 120 анкет (аргументы predict_for_multiple_problems)
+и для каждой — sha256 результата и его краткую сводку (метод, тип,
+вероятности или текст ошибки). Эталон снят с исходной версии mod.py, где
+проблемы обрабатывались по одной; оптимизации подбора должны давать
+побитово тот же результат, и сверка должна проходить после каждого изменения.
+
+Намеренное изменение результатов вносится вместе с новым эталоном в том же
+коммите; причина записывается в reference.changes файла эталона.
+
+    python parity_check.py                                  # сверить, код возврата 1 при расхождениях
+    python parity_check.py --save --reason "что изменилось"  # перезаписать эталон
+"""
+import argparse
+import hashlib
+import json
+import logging
+import sys
+
+PARITY_PATH = "parity_profiles.json"
+# Поля рекомендаций, которых нет в исходных результатах: номер шаблона в каталоге
+IGNORED_FIELDS = ('template_id',)
+
+
+def _comparable(results):
+    return [
+        {**result, 'recommendations': [
+            {key: value for key, value in recommendation.items() if key not in IGNORED_FIELDS}
+            for recommendation in result['recommendations']
+        ]} if 'recommendations' in result else result
+        for result in results
+    ]
+
+
+def result_digest(results):
+    return hashlib.sha256(
+        json.dumps(_comparable(results), ensure_ascii=False, sort_keys=True, default=str).encode('utf-8')
+    ).hexdigest()
+
+
+def result_summary(results):
+    """Короткое описание результата, чтобы расхождение было видно без полного текста шаблонов"""
+    summary = []
+    for result in results:
+        if 'error' in result:
+            summary.append({'error': result['error']})
+            continue
+        summary.append({
+            'problem': result['problem'],
+            'recommendations': [[r['method'], r['type'], r['success_prob'], r['base_prob']]
+                                for r in result['recommendations']]
+        })
+    return summary
+
+
+def evaluate(profiles):
+    from mod import predict_for_multiple_problems
+    return [predict_for_multiple_problems(**profile['args']) for profile in profiles]
+
+
+def compare(profiles, results):
+    """Номера анкет, результат которых отличается от эталона"""
+    return [i for i, (profile, result) in enumerate(zip(profiles, results))
+            if result_digest(result) != profile['digest']]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сверка рекомендаций с эталонным набором анкет")
+    parser.add_argument('--path', default=PARITY_PATH)
+    parser.add_argument('--save', action='store_true', help="записать текущие результаты как эталон")
+    parser.add_argument('--reason', default=None, help="почему результаты намеренно изменились (для --save)")
+    args = parser.parse_args()
+    if args.save and not args.reason:
+        parser.error("--save требует --reason: намеренное изменение результатов должно быть описано")
+    logging.disable(logging.CRITICAL)
+
+    with open(args.path, 'r', encoding='utf-8') as f:
+        reference = json.load(f)
+    profiles = reference['profiles']
+    results = evaluate(profiles)
+
+    if args.save:
+        changed = compare(profiles, results)
+        for profile, result in zip(profiles, results):
+            profile['digest'] = result_digest(result)
+            profile['summary'] = result_summary(result)
+        reference['reference']['changes'].append({'reason': args.reason, 'changed_profiles': changed})
+        with open(args.path, 'w', encoding='utf-8') as f:
+            json.dump(reference, f, ensure_ascii=False, indent=1)
+        print(f"Эталон сохранён: {args.path} ({len(profiles)} анкет, изменилось {len(changed)})")
+        return 0
+
+    mismatches = compare(profiles, results)
+    print(f"Анкет: {len(profiles)}, расхождений: {len(mismatches)}")
+    for i in mismatches[:10]:
+        print(f"  #{i}: ожидалось {json.dumps(profiles[i]['summary'], ensure_ascii=False)}")
+        print(f"  #{i}: получено  {json.dumps(result_summary(results[i]), ensure_ascii=False)}")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
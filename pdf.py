@@ -1,58 +1,69 @@
+import io
 import os
-from reportlab.lib.pagesizes import A4
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.lib.colors import HexColor
+import re
+import json
+import hashlib
+import logging
+from functools import lru_cache
 from datetime import datetime
 
+from cache import LRUCache, DiskLRUCache
+from metrics import start_trace
+
+# reportlab импортируется внутри функций: он нужен только тем, кто выгружает PDF
+
+FONT_DIR = "fonts"
+FONT_PATH = os.path.join(FONT_DIR, "DejaVuSans.ttf")
+REPORTS_DIR = "reports"
+# Версия содержимого отчёта: увеличивать при любом изменении текстов, вёрстки
+# или шрифта, чтобы пакетная перегенерация не пропускала старые отчёты
+REPORT_VERSION = 1
+
+_PAGE_OBJECT = re.compile(rb"/Type\s*/Page(?![a-zA-Z])")
+
+# Кэш готовых отчётов по содержимому: файлы reports/cache/<sha256>.pdf с общим
+# бюджетом на диске и небольшой кэш байтов в памяти процесса перед ним
+PDF_CACHE_DIR = os.path.join(REPORTS_DIR, "cache")
+PDF_CACHE_BYTES = int(float(os.environ.get("BEAUTY_PDF_CACHE_MB", "256")) * 1024 * 1024)
+PDF_MEMORY_CACHE_SIZE = int(os.environ.get("BEAUTY_PDF_MEMORY_CACHE_SIZE", "32"))
+pdf_disk_cache = DiskLRUCache(PDF_CACHE_DIR, PDF_CACHE_BYTES, suffix=".pdf")
+pdf_memory_cache = LRUCache(PDF_MEMORY_CACHE_SIZE)
+
+# Поля, которые build_story выводит в отчёт; остальные на содержимое не влияют
+PRINTED_PROFILE_FIELDS = ('name', 'gender', 'is_pregnant', 'skin_type', 'age_range',
+                          'problem', 'symptoms', 'allergies')
+PRINTED_ITEM_FIELDS = ('method', 'type', 'course_duration', 'template', 'success_prob',
+                       'contraindications', 'expected_results')
+
+@lru_cache(maxsize=None)
 def setup_fonts():
-    font_dir = "fonts"
-    os.makedirs(font_dir, exist_ok=True)
-    font_path = os.path.join(font_dir, "DejaVuSans.ttf")
-    
-    if not os.path.exists(font_path):
-        try:
-            import urllib.request
-            url = "https://github.com/dejavu-fonts/dejavu-fonts/raw/master/ttf/DejaVuSans.ttf"
-            urllib.request.urlretrieve(url, font_path)
-        except Exception as e:
-            print(f"Ошибка загрузки шрифта: {e}")
-    
+    """Регистрирует шрифт с кириллицей один раз на процесс.
+
+    Шрифт берётся только из папки fonts/ репозитория — без загрузки из сети.
+    Если файла нет, используется встроенный Helvetica.
+    """
+    if not os.path.exists(FONT_PATH):
+        logging.warning(f"Шрифт {FONT_PATH} не найден, используется Helvetica")
+        return 'Helvetica'
     try:
-        if os.path.exists(font_path):
-            pdfmetrics.registerFont(TTFont('DejaVuSans', font_path))
-            return 'DejaVuSans'
-    except:
-        pass
+        from reportlab.pdfbase import pdfmetrics
+        from reportlab.pdfbase.ttfonts import TTFont
+        pdfmetrics.registerFont(TTFont('DejaVuSans', FONT_PATH))
+        return 'DejaVuSans'
+    except Exception as e:
+        logging.error(f"Ошибка регистрации шрифта: {e}")
     return 'Helvetica'
 
-FONT_NAME = setup_fonts()
+@lru_cache(maxsize=None)
+def get_styles():
+    """Стили абзацев отчёта; строятся один раз на процесс и дальше только читаются"""
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.lib.colors import HexColor
 
-def generate_pdf_report(user_data, recommendations, session_id):
-    reports_dir = "reports"
-    os.makedirs(reports_dir, exist_ok=True)
-    
-    filename = os.path.join(
-        reports_dir,
-        f"{session_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
-    )
-    
-    # Увеличиваем поля страницы, чтобы текст не обрезался
-    doc = SimpleDocTemplate(
-        filename,
-        pagesize=A4,
-        leftMargin=36,  # Увеличиваем левое поле (было по умолчанию 72, уменьшаем до 36 пунктов = 0.5 дюйма)
-        rightMargin=36,  # Увеличиваем правое поле
-        topMargin=36,  # Увеличиваем верхнее поле
-        bottomMargin=36,  # Увеличиваем нижнее поле
-        encoding='utf-8'
-    )
-    
+    font_name = setup_fonts()
     styles = getSampleStyleSheet()
     for style in ['Title', 'Heading2', 'Normal', 'Bullet']:
-        styles[style].fontName = FONT_NAME
+        styles[style].fontName = font_name
         styles[style].encoding = 'UTF-8'
     
     # Настраиваем стиль для основного текста
@@ -87,7 +98,39 @@ def generate_pdf_report(user_data, recommendations, session_id):
     footnote_style.fontSize = 8
     footnote_style.textColor = HexColor('#666666')
     footnote_style.leading = 10
-    
+    return styles, footnote_style
+
+@lru_cache(maxsize=None)
+def font_fingerprint():
+    """Контрольная сумма файла шрифта (или имя встроенного шрифта), без импорта reportlab"""
+    if not os.path.exists(FONT_PATH):
+        return 'Helvetica'
+    with open(FONT_PATH, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def report_cache_key(user_data, recommendations):
+    """Ключ содержимого отчёта: выводимые поля анкеты и рекомендаций, версия отчёта и шрифт.
+
+    Отсутствующее поле и поле со значением None различаются: в отчёте для
+    них выводится разный текст.
+    """
+    payload = {
+        'report_version': REPORT_VERSION,
+        'font': font_fingerprint(),
+        'profile': {field: user_data[field] for field in PRINTED_PROFILE_FIELDS if field in user_data},
+        'daily_routine': [
+            {field: item[field] for field in PRINTED_ITEM_FIELDS if field in item}
+            for item in recommendations.get('daily_routine', [])
+        ]
+    }
+    encoded = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()
+
+def build_story(user_data, recommendations):
+    """Собирает содержимое отчёта в виде списка элементов reportlab"""
+    from reportlab.platypus import Paragraph, Spacer
+
+    styles, footnote_style = get_styles()
     story = []
     
     # Заголовок документа
@@ -183,6 +226,102 @@ def generate_pdf_report(user_data, recommendations, session_id):
     story.append(Spacer(1, 12))
     signature = Paragraph("© 2025 Beauty Tracker | Создано с заботой для вашей кожи 🌸", footnote_style)
     story.append(signature)
-    
+    return story
+
+def render_pdf_report(user_data, recommendations, on_progress=None, trace=None):
+    """Строит PDF целиком в памяти и возвращает его байты.
+
+    on_progress, если задан, получает долю уже размещённых элементов (0..1).
+    trace (metrics.Trace) получает этапы pdf_layout и pdf_render.
+    """
+    from reportlab.lib.pagesizes import A4
+    from reportlab.platypus import SimpleDocTemplate
+
+    buffer = io.BytesIO()
+    # Увеличиваем поля страницы, чтобы текст не обрезался
+    doc = SimpleDocTemplate(
+        buffer,
+        pagesize=A4,
+        leftMargin=36,  # Увеличиваем левое поле (было по умолчанию 72, уменьшаем до 36 пунктов = 0.5 дюйма)
+        rightMargin=36,  # Увеличиваем правое поле
+        topMargin=36,  # Увеличиваем верхнее поле
+        bottomMargin=36,  # Увеличиваем нижнее поле
+        encoding='utf-8'
+    )
+    story = build_story(user_data, recommendations)
+    if trace is not None:
+        trace.mark('pdf_layout')
+    if on_progress is not None:
+        total = max(len(story), 1)
+
+        def progress_callback(kind, value):
+            if kind == 'PROGRESS':
+                on_progress(min(value / total, 1.0))
+
+        doc.setProgressCallBack(progress_callback)
     doc.build(story)
-    return filename
\ No newline at end of file
+    if trace is not None:
+        trace.mark('pdf_render')
+    return buffer.getvalue()
+
+def count_pdf_pages(pdf_bytes):
+    """Число страниц в готовом PDF (по объектам /Type /Page)"""
+    return len(_PAGE_OBJECT.findall(pdf_bytes))
+
+def save_pdf_report(pdf_bytes, session_id, reports_dir=REPORTS_DIR):
+    """Сохраняет готовый PDF в архив на диске; возвращает путь к файлу"""
+    os.makedirs(reports_dir, exist_ok=True)
+    filename = os.path.join(
+        reports_dir,
+        f"{session_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
+    )
+    with open(filename, 'wb') as f:
+        f.write(pdf_bytes)
+    return filename
+
+def get_pdf_report(user_data, recommendations, on_progress=None):
+    """Байты отчёта из кэша по содержимому; строит PDF, только если такого ещё не было"""
+    trace = start_trace()
+    key = report_cache_key(user_data, recommendations)
+    pdf_bytes = pdf_memory_cache.get(key)
+    if pdf_bytes is None:
+        pdf_bytes = pdf_disk_cache.get(key)
+        if trace is not None:
+            trace.mark('pdf_cache_lookup')
+        if pdf_bytes is None:
+            pdf_bytes = render_pdf_report(user_data, recommendations, on_progress, trace)
+            pdf_disk_cache.put(key, pdf_bytes)
+            if trace is not None:
+                trace.mark('pdf_store')
+        pdf_memory_cache.put(key, pdf_bytes)
+    if on_progress is not None:
+        on_progress(1.0)
+    if trace is not None:
+        trace.finish('pdf_total')
+    return pdf_bytes
+
+def generate_pdf_report(user_data, recommendations, session_id=None):
+    """Возвращает путь к PDF в кэше отчётов (reports/cache/), строя его при необходимости.
+
+    Одинаковое содержимое хранится один раз, независимо от сессии, и повторная
+    выгрузка не пишет новых файлов; файл может быть вытеснен позже, когда кэш
+    превысит бюджет на диске. session_id оставлен для совместимости со старыми
+    вызовами и на результат не влияет: копии в архив reports/ пишутся только
+    при BEAUTY_PDF_ARCHIVE=1 (app.py, через save_pdf_report).
+    """
+    trace = start_trace()
+    key = report_cache_key(user_data, recommendations)
+    path = pdf_disk_cache.get_path(key)
+    if path is None:
+        pdf_bytes = pdf_memory_cache.get(key)
+        if trace is not None:
+            trace.mark('pdf_cache_lookup')
+        if pdf_bytes is None:
+            pdf_bytes = render_pdf_report(user_data, recommendations, trace=trace)
+            pdf_memory_cache.put(key, pdf_bytes)
+        path = pdf_disk_cache.put(key, pdf_bytes)
+        if trace is not None:
+            trace.mark('pdf_store')
+    if trace is not None:
+        trace.finish('pdf_total')
+    return path
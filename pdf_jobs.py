@@ -0,0 +1,126 @@
+"""Фоновая очередь построения PDF-отчётов.
+
+Вёрстка reportlab выполняется в ограниченном пуле потоков, а не в потоке
+скрипта Streamlit. submit возвращает задание, которое интерфейс опрашивает
+(статус и прогресс), пока отчёт не будет готов. Пока у пользователя есть
+незавершённое задание, повторные нажатия возвращают его же.
+"""
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from pdf import get_pdf_report, save_pdf_report
+
+logger = logging.getLogger(__name__)
+
+PDF_WORKERS = int(os.environ.get("BEAUTY_PDF_WORKERS", "2"))
+PDF_MAX_PENDING = int(os.environ.get("BEAUTY_PDF_MAX_PENDING", "32"))
+PDF_JOB_TTL = float(os.environ.get("BEAUTY_PDF_JOB_TTL", "600"))  # сколько секунд хранить готовые отчёты
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+
+class QueueFull(Exception):
+    """В очереди уже слишком много незавершённых заданий"""
+
+
+class PdfJob:
+    """Задание на построение одного отчёта"""
+
+    def __init__(self, key):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.status = QUEUED
+        self.progress = 0.0
+        self.result = None
+        self.error = None
+        self.created_at = time.monotonic()
+        self.finished_at = None
+
+    @property
+    def active(self):
+        return self.status in (QUEUED, RUNNING)
+
+
+class PdfJobQueue:
+    """Ограниченный пул потоков для отчётов с дедупликацией по ключу пользователя"""
+
+    def __init__(self, max_workers=PDF_WORKERS, max_pending=PDF_MAX_PENDING, job_ttl=PDF_JOB_TTL):
+        self.max_pending = max_pending
+        self.job_ttl = job_ttl
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="pdf-report")
+        self._jobs = {}
+        self._active_by_key = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key, user_data, recommendations, archive_session_id=None):
+        """Ставит отчёт в очередь; если у key уже есть незавершённое задание, возвращает его"""
+        with self._lock:
+            self._drop_expired()
+            job = self._active_by_key.get(key)
+            if job is not None and job.active:
+                return job
+            pending = sum(1 for j in self._jobs.values() if j.active)
+            if pending >= self.max_pending:
+                raise QueueFull(f"В очереди уже {pending} отчётов")
+            job = PdfJob(key)
+            self._jobs[job.id] = job
+            self._active_by_key[key] = job
+        self._executor.submit(self._run, job, user_data, recommendations, archive_session_id)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self):
+        with self._lock:
+            statuses = [job.status for job in self._jobs.values()]
+        return {status: statuses.count(status) for status in (QUEUED, RUNNING, DONE, FAILED)}
+
+    def _run(self, job, user_data, recommendations, archive_session_id):
+        job.status = RUNNING
+
+        def on_progress(fraction):
+            job.progress = fraction
+
+        try:
+            result = get_pdf_report(user_data, recommendations, on_progress=on_progress)
+            if archive_session_id is not None:
+                save_pdf_report(result, session_id=archive_session_id)
+        except Exception as e:
+            logger.error(f"Ошибка при создании PDF: {str(e)}")
+            job.error = str(e)
+            job.finished_at = time.monotonic()
+            job.status = FAILED
+            return
+        job.result = result
+        job.progress = 1.0
+        job.finished_at = time.monotonic()
+        job.status = DONE
+
+    def _drop_expired(self):
+        now = time.monotonic()
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if not job.active and now - job.finished_at > self.job_ttl]
+        for job_id in expired:
+            job = self._jobs.pop(job_id)
+            if self._active_by_key.get(job.key) is job:
+                del self._active_by_key[job.key]
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_pdf_job_queue():
+    """Возвращает общую для процесса очередь отчётов"""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = PdfJobQueue()
+    return _queue
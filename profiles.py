@@ -0,0 +1,184 @@
+"""Справочники анкеты и сборка рекомендаций по анкете.
+
+Общий код для приложения и пакетных утилит: перевод симптомов в проблемы
+и плоский список рекомендаций, который показывается пользователю и
+попадает в PDF-отчёт.
+"""
+import logging
+import random
+
+import inference
+from mod import predict_batch
+
+SKIN_TYPES = ['Нормальная', 'Сухая', 'Жирная', 'Не уверен(а)']
+AGE_RANGES = ['18-25', '25-35', '35-45', '45+']
+GENDERS = ['Мужской', 'Женский']
+EFFECTS = ["Увлажнение", "Лифтинг", "Устранение морщин", "Очищение пор", "Выравнивание тона",
+          "Устранение жирности кожи лица", "Противовоспалительный", "Антивозрастной", "Осветление", "Восстановление кожи лица"]
+SYMPTOMS = {
+    'Черные точки': ['Закупоренные поры', 'Темные точки на поверхности кожи', 'Неровная текстура кожи', 'Шероховатость при прикосновении', 'Серый цвет лица из-за окисления кожного сала'],
+    'Морщины': ['Мелкие линии и складки на коже', 'Потеря упругости',
+                'Дряблость кожи', '"Гусиные лапки" вокруг глаз', 'Носогубные складки',
+                'Неравномерный рельеф кожи', 'Потеря четкости овала лица'],
+    'Обезвоженность': ['Чувство стянутости', 'Шелушение',
+                       'Тусклый цвет лица', 'Мелкие морщинки',
+                       'Повышенная чувствительность', 'Раздражение', 'Зуд', 'Неравномерный тон',
+                       'При надавливании кожа медленно возвращается в исходное положение'],
+    'Жирный блеск': ["Излишняя работа сальных желез",
+                     'Блестящая кожа, особенно в Т-зоне',
+                     'Расширенные поры', 'Склонность к образованию акне',
+                     'Жирность появляется через 2-3 часа после умывания',
+                     'Макияж быстро "плывет"']
+}
+SYMPTOM_DESCRIPTIONS = {
+    'Закупоренные поры': 'Поры забиты кожным салом или омертвевшими клетками, что может привести к появлению черных точек или акне.',
+    'Темные точки на поверхности кожи': 'Маленькие темные пятна, обычно на носу, щеках или подбородке, вызванные окислением кожного сала в порах.',
+    'Неровная текстура кожи': 'Кожа выглядит грубой или неровной на ощупь, часто из-за сухости или закупоренных пор.',
+    'Шероховатость при прикосновении': 'Кожа ощущается шершавой или грубой при касании, часто из-за сухости или ороговения.',
+    'Мелкие линии и складки': 'Тонкие морщины, которые появляются на коже, часто из-за старения или сухости.',
+    'Потеря упругости': 'Кожа становится менее эластичной, может казаться дряблой или обвисшей.',
+    '"Гусиные лапки" вокруг глаз': 'Мелкие морщинки, расходящиеся от внешних уголков глаз, напоминающие следы лапок.',
+    'Носогубные складки': 'Глубокие линии, идущие от крыльев носа к уголкам рта, часто усиливаются с возрастом.',
+    'Чувство стянутости': 'Ощущение, что кожа "натянута" или сухая, особенно после умывания.',
+    'Шелушение': 'Кожа отслаивается мелкими чешуйками, часто из-за сухости или обезвоживания.',
+    'Тусклый цвет лица': 'Кожа выглядит бледной, сероватой или лишенной сияния.',
+    'Повышенная чувствительность': 'Кожа реагирует покраснением, жжением или раздражением на косметику, погоду и т.д.',
+    'Излишняя работа сальных желез': 'Кожа становится жирной из-за чрезмерного выделения кожного сала.',
+    'Блестящая кожа в Т-зоне': 'Лоб, нос и подбородок выглядят жирными и блестящими, особенно к середине дня.',
+    'Расширенные поры': 'Поры выглядят крупными и заметными, часто на носу, щеках или подбородке.',
+    'Склонность к акне': 'Частое появление прыщей, воспалений или угрей на коже.'
+}
+CONTRAINDICATIONS = [
+    "Злокачественные новообразования",
+    "Острые инфекционные заболевания",
+    "Дерматиты или экзема",
+    "Нет"
+]
+ALLERGIES = [
+    "Аллергия на салициловую кислоту",
+    "Аллергия на ретинол",
+    "Аллергия на витамин С",
+    "Аллергия на пептиды",
+    "Аллергия на гиалуроновую кислоту",
+    "Нет"
+]
+
+
+def symptoms_to_problems(symptoms):
+    symptom_to_problem = {}
+    for problem, symptom_list in SYMPTOMS.items():
+        unified_problem = problem.replace("ё", "е")
+        for symptom in symptom_list:
+            symptom_to_problem[symptom] = unified_problem
+    problems = list(set(symptom_to_problem.get(s, "") for s in symptoms if s in symptom_to_problem))
+    logging.debug("Симптомы %s преобразованы в проблемы: %s", symptoms, problems)
+    return problems
+
+
+def format_template_text(template):
+    lines = template.split('\n')
+    formatted_lines = []
+    for line in lines:
+        line = line.strip()
+        if line:
+            if ': ' in line:
+                key, value = line.split(': ', 1)
+                formatted_lines.append(f"**{key}:** {value}")
+            else:
+                formatted_lines.append(f"{line}")
+    return '\n\n'.join(formatted_lines)  # Двойной перенос для разделения блоков
+
+
+def recommendation_request(user_data):
+    """Проблемы анкеты и аргументы predict_for_multiple_problems для неё"""
+    user_symptoms = user_data['symptoms']
+    user_problems = list(set(symptoms_to_problems(user_symptoms)))
+    logging.debug("Обнаружены проблемы: %s", user_problems)
+    return user_problems, {
+        'problems': user_problems,
+        'skin_type': user_data['skin_type'],
+        'age_range': user_data['age_range'],
+        'symptoms': user_symptoms,
+        'user_allergies': user_data['allergies'],
+        'user_contraindications': user_data['contraindications'],
+        'is_pregnant': user_data['is_pregnant'],
+        'top_per_problem': 3
+    }
+
+
+def flatten_recommendations(user_symptoms, all_results):
+    """Плоский список рекомендаций по всем проблемам для показа и PDF"""
+    all_recommendations = []
+    problems_with_errors = []
+
+    for problem_result in all_results:
+        if 'error' in problem_result:
+            error_message = problem_result['error']
+            logging.warning(f"Ошибка для проблемы: {error_message}")
+            problems_with_errors.append(error_message)
+            continue
+        
+        problem = problem_result['problem']
+        recommendations = problem_result.get('recommendations', [])
+        
+        if not recommendations:
+            logging.warning(f"Для проблемы '{problem}' не найдено рекомендаций")
+            continue
+        
+        for rec in recommendations:
+            all_recommendations.append({
+                'problem': problem,
+                'symptom': ', '.join([s for s in user_symptoms if symptoms_to_problems([s])[0] == problem]),
+                'method': rec['method'],
+                'type': rec['type'],
+                'success_prob': rec['success_prob'],  # Сохраняем процент для дальнейшего форматирования
+                'course_duration': rec.get('course_duration', 'Не указана'),
+                'expected_results': rec.get('expected_effect', 'Не указан'),
+                'contraindications': ', '.join(rec.get('contraindications', ['Нет'])),
+                'template': rec.get('template', 'Описание отсутствует')
+            })
+    return all_recommendations
+
+
+def compute_recommendations(user_data):
+    """Запускает модель и собирает плоский список рекомендаций по всем проблемам.
+
+    Запрос оценивается общим сервисом inference вместе с запросами других
+    сессий, пришедшими в то же окно.
+    """
+    user_problems, request = recommendation_request(user_data)
+    all_results = inference.predict(request)
+    return user_problems, flatten_recommendations(user_data['symptoms'], all_results)
+
+
+def compute_recommendations_batch(profiles):
+    """То же для пачки анкет: кандидаты всех анкет оцениваются одним вызовом модели"""
+    requests = [recommendation_request(user_data) for user_data in profiles]
+    batch_results = predict_batch([request for _, request in requests])
+    return [
+        (user_problems, flatten_recommendations(user_data['symptoms'], all_results))
+        for user_data, (user_problems, _), all_results in zip(profiles, requests, batch_results)
+    ]
+
+
+def synthetic_profiles(count, seed=0):
+    """Случайные заполненные анкеты из справочников (для нагрузочных тестов и бенчмарков)"""
+    rng = random.Random(seed)
+    all_symptoms = [s for group in SYMPTOMS.values() for s in group]
+    profiles = []
+    for number in range(count):
+        symptoms = rng.sample(all_symptoms, rng.randint(1, 4))
+        gender = rng.choice(GENDERS)
+        profiles.append({
+            'name': f"Анкета {number}",
+            'gender': gender,
+            'is_pregnant': gender == 'Женский' and rng.random() < 0.1,
+            'age_range': rng.choice(AGE_RANGES),
+            'skin_type': rng.choice(SKIN_TYPES[:3]),
+            'symptoms': symptoms,
+            'effects': rng.sample(EFFECTS, rng.randint(1, 3)),
+            'contraindications': rng.sample(CONTRAINDICATIONS[:-1], rng.randint(0, 1)),
+            'allergies': rng.sample(ALLERGIES[:-1], rng.randint(0, 2)),
+            'problem': ', '.join(symptoms_to_problems(symptoms))
+        })
+    return profiles
@@ -0,0 +1,241 @@
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+
+from catalog import Catalog, compile_catalog, compiled_catalog_paths, load_compiled_catalog
+from native_model import NativeRegressor, compile_pipeline
+
+logger = logging.getLogger(__name__)
+
+MODEL_DIR = "models"  # Папка models в корне репозитория
+REGRESSOR_FILE = "best_regressor_tuned_pipeline.pkl"
+TEMPLATES_FILE = "valid_templates.json"
+NATIVE_FILE = "regressor_native.npz"
+
+# Использовать NumPy-вычислитель вместо sklearn-пайплайна (см. native_model.py)
+USE_NATIVE_MODEL = os.environ.get("BEAUTY_NATIVE_MODEL", "1") != "0"
+# Держать тексты шаблонов в отображаемом в память файле (см. catalog.compile_catalog)
+USE_COMPILED_CATALOG = os.environ.get("BEAUTY_COMPILED_CATALOG", "1") != "0"
+
+# Как часто (в секундах) проверять файлы на диске на предмет изменений
+CHECK_INTERVAL = float(os.environ.get("BEAUTY_MODEL_CHECK_INTERVAL", "2.0"))
+
+
+@dataclass(frozen=True)
+class ModelSnapshot:
+    """Неизменяемый набор загруженных артефактов: модель, шаблоны, их индекс и версия"""
+    regressor: object
+    templates: object
+    catalog: Catalog
+    regressor_sha: str
+    templates_sha: str
+    loaded_at: float
+    file_stats: dict = field(repr=False)
+    # Признаки шаблонов для NativeRegressor.request_features; None для sklearn-пайплайна
+    template_features: object = field(default=None, repr=False)
+
+    @property
+    def version(self):
+        return f"{self.regressor_sha[:8]}-{self.templates_sha[:8]}"
+
+
+def _file_stat(path):
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+
+def _read_with_checksum(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    return data, hashlib.sha256(data).hexdigest()
+
+
+class ModelRegistry:
+    """Потокобезопасный реестр модели и шаблонов.
+
+    Артефакты загружаются один раз на процесс. Не чаще раза в check_interval
+    секунд проверяются mtime и размер файлов; если они изменились, новая версия
+    загружается целиком и подменяет старую одной операцией присваивания.
+    Пока идёт загрузка, читатели продолжают работать со старым снимком.
+    """
+
+    def __init__(self, model_dir=MODEL_DIR, check_interval=CHECK_INTERVAL):
+        self.model_dir = model_dir
+        self.check_interval = check_interval
+        self.regressor_path = os.path.join(model_dir, REGRESSOR_FILE)
+        self.templates_path = os.path.join(model_dir, TEMPLATES_FILE)
+        self.native_path = os.path.join(model_dir, NATIVE_FILE)
+        self._snapshot = None
+        self._last_check = 0.0
+        self._load_lock = threading.Lock()
+
+    def get(self):
+        """Возвращает актуальный снимок, при необходимости перезагружая артефакты.
+
+        Проверку и перезагрузку выполняет один поток; остальные в это время
+        получают текущий снимок и ждут блокировку только при первой загрузке.
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            return self._refresh()
+        if time.monotonic() - self._last_check >= self.check_interval:
+            if self._load_lock.acquire(blocking=False):
+                try:
+                    snapshot = self._refresh_locked()
+                finally:
+                    self._load_lock.release()
+        return snapshot
+
+    @property
+    def version(self):
+        return self.get().version
+
+    def reload(self):
+        """Принудительно перечитывает артефакты с диска"""
+        return self._refresh(force=True)
+
+    def _current_stats(self):
+        required_files = {
+            "regressor_pipeline": self.regressor_path,
+            "templates": self.templates_path
+        }
+        missing = [name for name, path in required_files.items() if not os.path.exists(path)]
+        if missing:
+            raise FileNotFoundError(f"Отсутствуют файлы: {missing}")
+        return {path: _file_stat(path) for path in required_files.values()}
+
+    def _refresh(self, force=False):
+        with self._load_lock:
+            return self._refresh_locked(force)
+
+    def _refresh_locked(self, force=False):
+        """Проверка файлов и перезагрузка; вызывается под _load_lock"""
+        snapshot = self._snapshot
+        # Другой поток мог уже обновить снимок, пока мы ждали блокировку
+        if not force and snapshot is not None and time.monotonic() - self._last_check < self.check_interval:
+            return snapshot
+        try:
+            stats = self._current_stats()
+            if force or snapshot is None or stats != snapshot.file_stats:
+                snapshot = self._load(stats, snapshot)
+                self._snapshot = snapshot
+        except Exception as e:
+            if snapshot is None:
+                raise
+            # Файл мог быть записан не полностью — остаёмся на старой версии
+            logger.error(f"Не удалось обновить модель, используется версия {snapshot.version}: {str(e)}")
+        self._last_check = time.monotonic()
+        return snapshot
+
+    def _load_regressor(self, data, sha):
+        """Загружает NumPy-версию модели, если она собрана из этого же .pkl, иначе sklearn-пайплайн"""
+        if USE_NATIVE_MODEL and os.path.exists(self.native_path):
+            try:
+                native = NativeRegressor.load(self.native_path)
+                if native.source_sha256 == sha:
+                    return native
+                logger.info("NumPy-версия модели устарела, пересобираем из .pkl")
+            except Exception as e:
+                logger.warning(f"Не удалось загрузить {self.native_path}: {str(e)}")
+
+        import joblib
+        pipeline = joblib.load(io.BytesIO(data))
+        if not USE_NATIVE_MODEL:
+            return pipeline
+        try:
+            arrays = compile_pipeline(pipeline, sha)
+        except ValueError as e:
+            logger.warning(f"Модель не поддерживается NumPy-вычислителем, используется sklearn: {str(e)}")
+            return pipeline
+        try:
+            NativeRegressor.save(arrays, self.native_path)
+        except OSError as e:
+            logger.warning(f"Не удалось сохранить {self.native_path}: {str(e)}")
+        return NativeRegressor(arrays)
+
+    def _load_catalog(self, data, sha):
+        """Открывает скомпилированный каталог для этого JSON, при необходимости собирая его.
+
+        Некорректные шаблоны отклоняются при сборке (catalog.CatalogError):
+        первая загрузка падает, при обновлении остаётся прежняя версия.
+        """
+        if not USE_COMPILED_CATALOG:
+            return Catalog.from_templates(json.loads(data.decode('utf-8')))
+
+        meta_path, blob_path = compiled_catalog_paths(self.templates_path)
+        try:
+            catalog = load_compiled_catalog(meta_path, blob_path, sha)
+            if catalog is not None:
+                return catalog
+        except Exception as e:
+            logger.warning(f"Не удалось открыть скомпилированный каталог: {str(e)}")
+
+        templates = json.loads(data.decode('utf-8'))
+        try:
+            compile_catalog(templates, meta_path, blob_path, sha)
+            catalog = load_compiled_catalog(meta_path, blob_path, sha)
+            if catalog is not None:
+                return catalog
+        except OSError as e:
+            logger.warning(f"Не удалось сохранить скомпилированный каталог: {str(e)}")
+        return Catalog.from_templates(templates)
+
+    @staticmethod
+    def _template_features(regressor, catalog):
+        """Не зависящая от анкеты часть признаков всех шаблонов каталога"""
+        if not isinstance(regressor, NativeRegressor):
+            return None
+        return regressor.template_features(catalog.meta, catalog.method_complexity)
+
+    def _load(self, stats, previous):
+        regressor_data, regressor_sha = _read_with_checksum(self.regressor_path)
+        templates_data, templates_sha = _read_with_checksum(self.templates_path)
+
+        if previous is not None and regressor_sha == previous.regressor_sha:
+            regressor = previous.regressor
+        else:
+            regressor = self._load_regressor(regressor_data, regressor_sha)
+
+        if previous is not None and templates_sha == previous.templates_sha:
+            catalog = previous.catalog
+        else:
+            catalog = self._load_catalog(templates_data, templates_sha)
+        templates = catalog.templates
+
+        if previous is not None and regressor is previous.regressor and catalog is previous.catalog:
+            template_features = previous.template_features
+        else:
+            template_features = self._template_features(regressor, catalog)
+
+        snapshot = ModelSnapshot(
+            regressor=regressor,
+            templates=templates,
+            catalog=catalog,
+            regressor_sha=regressor_sha,
+            templates_sha=templates_sha,
+            loaded_at=time.time(),
+            file_stats=stats,
+            template_features=template_features
+        )
+        if previous is None or previous.version != snapshot.version:
+            logger.info(f"Загружена модель версии {snapshot.version} ({len(templates)} шаблонов)")
+        return snapshot
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """Возвращает общий для процесса реестр"""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = ModelRegistry()
+    return _registry
@@ -0,0 +1,225 @@
+"""Пакетная оценка большого файла анкет (CSV или JSONL).
+
+Файл читается пачками по --chunk-size строк; каждая пачка в процессе пула
+переводит симптомы в проблемы и оценивается одним вызовом модели
+(mod.predict_batch). Результаты пишутся по мере готовности в порядке
+входного файла, а в работе одновременно не больше 2 × --workers пачек,
+поэтому память не зависит от размера файла.
+
+    python score_profiles.py profiles.csv scored.csv
+    python score_profiles.py profiles.jsonl scored.jsonl --workers 4 --chunk-size 500
+
+Поля анкеты: id (необязательно), skin_type, age_range, symptoms, allergies,
+contraindications, is_pregnant. В CSV списки записываются в одной ячейке
+через ';' (--list-sep), is_pregnant — 1/0, true/false или да/нет.
+
+Выход JSONL — строка на анкету с рекомендациями по каждой проблеме (без
+длинных текстов шаблонов); выход CSV — строка на рекомендацию или ошибку.
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from logging_setup import LOG_FORMAT, LOG_LEVEL
+
+logger = logging.getLogger(__name__)
+
+SCORE_WORKERS = int(os.environ.get("BEAUTY_SCORE_WORKERS", str(os.cpu_count() or 1)))
+SCORE_CHUNK_SIZE = int(os.environ.get("BEAUTY_SCORE_CHUNK_SIZE", "250"))
+LIST_FIELDS = ('symptoms', 'allergies', 'contraindications')
+CSV_COLUMNS = ['id', 'problem', 'rank', 'method', 'type', 'success_prob', 'base_prob', 'error']
+TRUE_VALUES = {'1', 'true', 'yes', 'да', 'y'}
+
+
+def _file_format(path, explicit=None):
+    if explicit:
+        return explicit
+    return 'csv' if path.lower().endswith('.csv') else 'jsonl'
+
+
+def iter_profiles(path, file_format=None):
+    """Анкеты входного файла как словари (значения CSV — строки)"""
+    file_format = _file_format(path, file_format)
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        if file_format == 'csv':
+            yield from csv.DictReader(f)
+            return
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                yield {'_error': f"строка {line_number}: некорректный JSON ({str(e)})"}
+
+
+def normalize_profile(raw, list_sep=';'):
+    """Приводит анкету к типам predict_batch: списки строк и булев флаг беременности"""
+    profile = {'skin_type': raw.get('skin_type'), 'age_range': raw.get('age_range')}
+    for field in LIST_FIELDS:
+        value = raw.get(field) or []
+        if isinstance(value, str):
+            value = [item.strip() for item in value.split(list_sep) if item.strip()]
+        profile[field] = list(value)
+    pregnant = raw.get('is_pregnant', False)
+    if isinstance(pregnant, str):
+        pregnant = pregnant.strip().lower() in TRUE_VALUES
+    profile['is_pregnant'] = bool(pregnant)
+    return profile
+
+
+def _compact(recommendation):
+    """Рекомендация без длинных текстов шаблона"""
+    return {key: recommendation[key] for key in ('method', 'type', 'success_prob', 'base_prob')
+            if key in recommendation}
+
+
+def score_chunk(chunk, list_sep=';', top_per_problem=3):
+    """Выполняется в процессе пула: [(id, анкета)] -> [(id, проблемы, результаты или ошибка)]"""
+    from mod import predict_batch
+    from profiles import symptoms_to_problems
+
+    scored = []
+    requests = []
+    for record_id, raw in chunk:
+        if '_error' in raw:
+            scored.append((record_id, [], raw['_error']))
+            continue
+        profile = normalize_profile(raw, list_sep)
+        problems = symptoms_to_problems(profile['symptoms'])
+        scored.append((record_id, problems, None))
+        if problems:
+            requests.append({
+                'problems': problems,
+                'skin_type': profile['skin_type'],
+                'age_range': profile['age_range'],
+                'symptoms': profile['symptoms'],
+                'user_allergies': profile['allergies'],
+                'user_contraindications': profile['contraindications'],
+                'is_pregnant': profile['is_pregnant'],
+                'top_per_problem': top_per_problem
+            })
+
+    batch_results = iter(predict_batch(requests)) if requests else iter(())
+    output = []
+    for record_id, problems, error in scored:
+        if error is None and not problems:
+            error = "симптомы не соответствуют ни одной проблеме"
+        if error is not None:
+            output.append((record_id, problems, error))
+            continue
+        results = []
+        for result in next(batch_results):
+            if 'error' in result:
+                results.append({'error': result['error']})
+            else:
+                results.append({'problem': result['problem'],
+                                'recommendations': [_compact(r) for r in result['recommendations']]})
+        output.append((record_id, problems, results))
+    return output
+
+
+class ResultWriter:
+    """Пишет результаты построчно в JSONL или CSV"""
+
+    def __init__(self, path, file_format=None):
+        self.file_format = _file_format(path, file_format)
+        self._file = open(path, 'w', encoding='utf-8', newline='')
+        self._csv = None
+        if self.file_format == 'csv':
+            self._csv = csv.DictWriter(self._file, fieldnames=CSV_COLUMNS)
+            self._csv.writeheader()
+
+    def write(self, record_id, problems, results):
+        if self._csv is None:
+            record = {'id': record_id, 'problems': problems}
+            record['error' if isinstance(results, str) else 'results'] = results
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            return
+        if isinstance(results, str):
+            self._csv.writerow({'id': record_id, 'error': results})
+            return
+        for problem, result in zip(problems, results):
+            if 'error' in result:
+                self._csv.writerow({'id': record_id, 'problem': problem, 'error': result['error']})
+                continue
+            for rank, recommendation in enumerate(result['recommendations'], 1):
+                self._csv.writerow(dict(recommendation, id=record_id, problem=problem, rank=rank))
+
+    def close(self):
+        self._file.close()
+
+
+def score_file(input_path, output_path, workers=SCORE_WORKERS, chunk_size=SCORE_CHUNK_SIZE,
+               input_format=None, output_format=None, list_sep=';', top_per_problem=3, report_every=10.0):
+    """Оценивает все анкеты файла; возвращает сводку со скоростью в анкетах в секунду"""
+    records = (
+        (raw.get('id') or str(number), raw)
+        for number, raw in enumerate(iter_profiles(input_path, input_format), 1)
+    )
+    stats = {'profiles': 0, 'failed': 0, 'recommendations': 0}
+    start = time.monotonic()
+    last_report = start
+    writer = ResultWriter(output_path, output_format)
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # Очередь пачек в порядке входного файла: пишем голову, как только она готова
+            in_flight = deque()
+            while True:
+                while len(in_flight) < workers * 2:
+                    chunk = list(islice(records, chunk_size))
+                    if not chunk:
+                        break
+                    in_flight.append(executor.submit(score_chunk, chunk, list_sep, top_per_problem))
+                if not in_flight:
+                    break
+                for record_id, problems, results in in_flight.popleft().result():
+                    writer.write(record_id, problems, results)
+                    stats['profiles'] += 1
+                    if isinstance(results, str):
+                        stats['failed'] += 1
+                    else:
+                        stats['recommendations'] += sum(len(r.get('recommendations', [])) for r in results)
+
+                now = time.monotonic()
+                if now - last_report >= report_every:
+                    last_report = now
+                    logger.info(f"Оценено {stats['profiles']} анкет, "
+                                f"{stats['profiles'] / (now - start):.0f} анкет/с")
+    finally:
+        writer.close()
+
+    elapsed = time.monotonic() - start
+    stats['seconds'] = round(elapsed, 3)
+    stats['profiles_per_second'] = round(stats['profiles'] / elapsed, 1) if elapsed > 0 else 0.0
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пакетная оценка анкет из CSV или JSONL")
+    parser.add_argument('input')
+    parser.add_argument('output')
+    parser.add_argument('--workers', type=int, default=SCORE_WORKERS)
+    parser.add_argument('--chunk-size', type=int, default=SCORE_CHUNK_SIZE, help="анкет на один вызов модели")
+    parser.add_argument('--input-format', choices=['csv', 'jsonl'], default=None)
+    parser.add_argument('--output-format', choices=['csv', 'jsonl'], default=None)
+    parser.add_argument('--list-sep', default=';', help="разделитель списков в ячейках CSV")
+    parser.add_argument('--top-per-problem', type=int, default=3)
+    args = parser.parse_args()
+    logging.basicConfig(level=LOG_LEVEL, format=LOG_FORMAT)
+
+    stats = score_file(args.input, args.output, args.workers, args.chunk_size, args.input_format,
+                       args.output_format, args.list_sep, args.top_per_problem)
+    print(json.dumps(stats, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
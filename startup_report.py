@@ -0,0 +1,73 @@
+"""Отчёт о времени импорта модулей при старте приложения.
+
+Запускает `python -X importtime -c "import <модуль>"` в отдельном процессе
+и сводит время по пакетам верхнего уровня, чтобы было видно, какая
+зависимость замедлила старт.
+
+    python startup_report.py                 # разбор импорта app
+    python startup_report.py --module mod --top 10
+    python startup_report.py --max-ms 1500   # код возврата 1, если старт дольше
+"""
+import argparse
+import json
+import subprocess
+import sys
+from collections import defaultdict
+
+
+def measure_imports(module):
+    """Возвращает [(имя модуля, собственное время мкс, накопленное время мкс, глубина)]"""
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"Не удалось импортировать {module}:\n{completed.stderr[-2000:]}")
+
+    entries = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        entries.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return entries
+
+
+def summarize(entries):
+    """Суммарное время старта и собственное время по пакетам верхнего уровня"""
+    total_us = sum(cumulative for _, _, cumulative, depth in entries if depth == 0)
+    by_package = defaultdict(int)
+    for name, self_us, _, _ in entries:
+        by_package[name.split(".")[0]] += self_us
+    return total_us, sorted(by_package.items(), key=lambda item: -item[1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Разбор времени импорта при старте")
+    parser.add_argument('--module', default='app')
+    parser.add_argument('--top', type=int, default=15)
+    parser.add_argument('--max-ms', type=float, default=None, help="порог времени старта, мс")
+    parser.add_argument('--json', action='store_true', help="вывести результат в JSON")
+    args = parser.parse_args()
+
+    total_us, packages = summarize(measure_imports(args.module))
+    if args.json:
+        print(json.dumps({
+            'module': args.module,
+            'total_ms': round(total_us / 1000, 1),
+            'packages_ms': {name: round(us / 1000, 1) for name, us in packages[:args.top]}
+        }, ensure_ascii=False))
+    else:
+        print(f"Импорт {args.module}: {total_us / 1000:.1f} мс")
+        for name, us in packages[:args.top]:
+            print(f"  {name:<30} {us / 1000:8.1f} мс  {100 * us / max(total_us, 1):5.1f}%")
+
+    if args.max_ms is not None and total_us / 1000 > args.max_ms:
+        print(f"Старт дольше порога {args.max_ms} мс", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,60 @@
+"""Подготовка фонового изображения один раз при старте.
+
+Из assets/beauty.jpg собираются уменьшенные и пережатые варианты в static/,
+откуда Streamlit раздаёт их как обычные файлы (server.enableStaticServing в
+.streamlit/config.toml). В CSS тогда остаётся короткая ссылка вместо
+~256 КБ base64 при каждом перезапуске скрипта.
+"""
+import base64
+import logging
+import os
+import threading
+
+STATIC_DIR = "static"
+STATIC_URL = "app/static"  # так Streamlit отдаёт содержимое папки static/
+
+# Имя варианта -> (формат, макс. сторона в пикселях, качество)
+VARIANTS = {
+    'background.webp': ('WEBP', 1280, 55),
+    'background.jpg': ('JPEG', 1280, 65),
+    'thumbnail.webp': ('WEBP', 480, 75),
+}
+
+
+def _is_fresh(target, source):
+    return os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(source)
+
+
+def prepare_image_variants(source, static_dir=STATIC_DIR, prefix="beauty_"):
+    """Создаёт недостающие или устаревшие варианты изображения; возвращает {имя: путь}"""
+    os.makedirs(static_dir, exist_ok=True)
+    paths = {name: os.path.join(static_dir, prefix + name) for name in VARIANTS}
+    stale = [name for name, path in paths.items() if not _is_fresh(path, source)]
+    if not stale:
+        return paths
+
+    from PIL import Image
+    with Image.open(source) as image:
+        image = image.convert('RGB')
+        for name in stale:
+            image_format, max_side, quality = VARIANTS[name]
+            variant = image.copy()
+            variant.thumbnail((max_side, max_side))
+            # Имя уникально для процесса и потока: при старте несколько воркеров готовят варианты разом
+            tmp_path = f"{paths[name]}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                variant.save(tmp_path, image_format, quality=quality, optimize=True)
+                os.replace(tmp_path, paths[name])
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            logging.info(f"Подготовлен {paths[name]}: {os.path.getsize(paths[name])} байт")
+    return paths
+
+
+def background_css_url(paths, static_serving):
+    """Ссылка на фон для CSS: статический файл или, если раздача выключена, компактный data URI"""
+    if static_serving:
+        return f"{STATIC_URL}/{os.path.basename(paths['background.webp'])}"
+    with open(paths['background.jpg'], 'rb') as f:
+        return "data:image/jpeg;base64," + base64.b64encode(f.read()).decode('utf-8')
@@ -0,0 +1,142 @@
+"""Прогрев кэша рекомендаций по самым частым сохранённым анкетам.
+
+Анкеты, сохранённые app.save_to_json в журнал событий, сильно повторяются.
+При старте процесса (или по расписанию) самые частые профили заранее
+прогоняются через predict_for_multiple_problems, и их результаты оказываются
+в recommendation_cache ещё до прихода пользователей. В приложении прогрев
+запускает start_background_warmup (app.start_cache_warmup).
+
+Кэш у каждого процесса свой, поэтому запуск из командной строки ничего не
+прогревает в работающем сервере. Это отчёт: какие профили попали бы
+в прогрев, сколько раз они встречались и сколько времени занимает прогрев.
+
+    python warmup.py --top-k 100 --budget 10
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter
+
+from events import STORES, iter_stored_events, open_event_store
+from logging_setup import setup_logging
+from mod import predict_for_multiple_problems, recommendation_cache
+
+logger = logging.getLogger(__name__)
+
+WARMUP_TOP_K = int(os.environ.get("BEAUTY_WARMUP_TOP_K", "50"))
+WARMUP_TIME_BUDGET = float(os.environ.get("BEAUTY_WARMUP_BUDGET", "10"))
+WARMUP_INTERVAL = float(os.environ.get("BEAUTY_WARMUP_INTERVAL", "0"))  # 0 — только при старте
+
+
+def profile_key(data):
+    """Часть анкеты, от которой зависят рекомендации.
+
+    Проблемы сортируются: app сохраняет их в порядке set, который зависит
+    от процесса, а кэш рекомендаций хранит каждую проблему отдельно.
+    """
+    problems = tuple(sorted(p for p in data.get('problem', '').split(', ') if p))
+    return (
+        problems,
+        data.get('skin_type'),
+        data.get('age_range'),
+        tuple(data.get('symptoms', [])),
+        tuple(sorted(data.get('allergies', []))),
+        tuple(sorted(data.get('contraindications', []))),
+        bool(data.get('is_pregnant', False))
+    )
+
+
+def iter_stored_profiles(store=None, deadline=None):
+    """Читает сохранённые анкеты из журнала событий, начиная с самых свежих"""
+    for event in iter_stored_events(('user_data',), newest_first=True, store=store):
+        if deadline is not None and time.monotonic() >= deadline:
+            logger.info("Прогрев: время на чтение анкет истекло")
+            return
+        yield event.data
+
+
+def most_common_profiles(top_k=WARMUP_TOP_K, store=None, deadline=None):
+    """Возвращает top_k самых частых профилей в виде [(ключ, число повторов)]"""
+    counts = Counter()
+    for data in iter_stored_profiles(store, deadline):
+        key = profile_key(data)
+        if key[0] and key[1] and key[2]:
+            counts[key] += 1
+    return counts.most_common(top_k)
+
+
+def warm_recommendation_cache(top_k=WARMUP_TOP_K, time_budget=WARMUP_TIME_BUDGET, store=None, profiles=None):
+    """Заполняет кэш рекомендаций для самых частых профилей в пределах time_budget секунд"""
+    start = time.monotonic()
+    deadline = start + time_budget
+    if profiles is None:
+        profiles = most_common_profiles(top_k, store, deadline)
+
+    warmed = 0
+    for (problems, skin_type, age_range, symptoms, allergies, contraindications, is_pregnant), _ in profiles:
+        if time.monotonic() >= deadline:
+            break
+        predict_for_multiple_problems(
+            problems=list(problems),
+            skin_type=skin_type,
+            age_range=age_range,
+            symptoms=list(symptoms),
+            user_allergies=list(allergies),
+            user_contraindications=list(contraindications),
+            is_pregnant=is_pregnant,
+            top_per_problem=3
+        )
+        warmed += 1
+
+    stats = {
+        'profiles': len(profiles),
+        'warmed': warmed,
+        'seconds': round(time.monotonic() - start, 3),
+        'cache_size': len(recommendation_cache)
+    }
+    logger.info(f"Прогрев кэша рекомендаций: {stats}")
+    return stats
+
+
+def start_background_warmup(top_k=WARMUP_TOP_K, time_budget=WARMUP_TIME_BUDGET,
+                            interval=WARMUP_INTERVAL, store=None):
+    """Запускает прогрев в фоновом потоке; при interval > 0 повторяет его по расписанию"""
+    def run():
+        while True:
+            try:
+                warm_recommendation_cache(top_k, time_budget, store)
+            except Exception as e:
+                logger.error(f"Ошибка прогрева кэша: {str(e)}")
+            if interval <= 0:
+                return
+            time.sleep(interval)
+
+    thread = threading.Thread(target=run, name="recommendation-warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Отчёт о прогреве кэша рекомендаций: частые анкеты и время их обработки "
+                    "(кэш работающего сервера не меняется)"
+    )
+    parser.add_argument('--top-k', type=int, default=WARMUP_TOP_K)
+    parser.add_argument('--budget', type=float, default=WARMUP_TIME_BUDGET, help="секунд на прогрев")
+    parser.add_argument('--store', choices=sorted(STORES), default=None, help="хранилище событий")
+    parser.add_argument('--store-path', default=None)
+    args = parser.parse_args()
+    setup_logging(log_file=None)
+    store = open_event_store(args.store, args.store_path) if args.store else None
+    profiles = most_common_profiles(args.top_k, store, time.monotonic() + args.budget)
+    for (problems, skin_type, age_range, *_), count in profiles:
+        print(f"{count}\t{', '.join(problems)} / {skin_type} / {age_range}")
+    stats = warm_recommendation_cache(args.top_k, args.budget, store, profiles=profiles)
+    print(json.dumps(stats, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()